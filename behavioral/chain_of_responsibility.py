@@ -18,6 +18,15 @@ encapsulates the information about the request being made.
 
 
 import enum
+import sys
+import time
+import timeit
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 class PizzaSize(enum.Enum):
@@ -34,6 +43,11 @@ class PizzaTopping(enum.Enum):
     EXTRA_CHEESE = 3
 
 
+# Bit used for a topping in bitmask encoded toppings.
+TOPPING_BITS = {topping: 1 << index for index, topping in enumerate(PizzaTopping)}
+TOPPING_COLUMNS = {topping: index for index, topping in enumerate(PizzaTopping)}
+
+
 class Pizza:
 
     def __init__(self, size: PizzaSize, toppings: list[PizzaTopping]):
@@ -43,40 +57,451 @@ class Pizza:
     def get_cost(self) -> int:
         return self.size.value + sum(topping.value for topping in self.toppings)
 
+    def fingerprint(self) -> tuple:
+        # Size plus topping counts in PizzaTopping order, equal for pizzas that differ only in topping order.
+        counts = [0] * len(TOPPING_COLUMNS)
+        for topping in self.toppings:
+            counts[TOPPING_COLUMNS[topping]] += 1
+        return self.size, *counts
+
+
+SIZES = tuple(PizzaSize)
+TOPPINGS = tuple(PizzaTopping)
+# Topping counts of a CompactPizza are packed in one int, COUNT_BITS per topping.
+COUNT_BITS = 8
+COUNT_MASK = (1 << COUNT_BITS) - 1
+
+
+class CompactToppings:
+
+    """Read-only view of CompactPizza toppings that quacks like the Pizza.toppings list for handlers."""
+
+    __slots__ = ("_mask", "_counts", "_count")
+
+    def __init__(self, mask: int, counts: int, count: int):
+        self._mask = mask
+        self._counts = counts
+        self._count = count
+
+    def __contains__(self, topping: PizzaTopping) -> bool:
+        return bool(self._mask & TOPPING_BITS[topping])
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self):
+        for column, topping in enumerate(TOPPINGS):
+            yield from [topping] * ((self._counts >> (column * COUNT_BITS)) & COUNT_MASK)
+
+
+class CompactPizza:
+
+    """
+    Memory compact Pizza: size index, topping bitmask and packed topping counts in __slots__. Exposes the same size and
+    toppings interface as Pizza, so handlers work with it unchanged while topping checks become bit tests.
+    """
+
+    __slots__ = ("_size", "_mask", "_counts", "_count")
+
+    def __init__(self, size: PizzaSize, toppings: list[PizzaTopping]):
+        self._size = SIZES.index(size)
+        self._mask = 0
+        self._counts = 0
+        self._count = 0
+        for topping in toppings:
+            column = TOPPING_COLUMNS[topping]
+            if (self._counts >> (column * COUNT_BITS)) & COUNT_MASK == COUNT_MASK:
+                raise ValueError(f"Too many {topping.name} toppings")
+            self._mask |= TOPPING_BITS[topping]
+            self._counts += 1 << (column * COUNT_BITS)
+            self._count += 1
+
+    @classmethod
+    def from_pizza(cls, pizza: Pizza) -> "CompactPizza":
+        return cls(pizza.size, pizza.toppings)
+
+    @property
+    def size(self) -> PizzaSize:
+        return SIZES[self._size]
+
+    @property
+    def toppings(self) -> CompactToppings:
+        return CompactToppings(self._mask, self._counts, self._count)
+
+    def topping_count(self, topping: PizzaTopping) -> int:
+        return (self._counts >> (TOPPING_COLUMNS[topping] * COUNT_BITS)) & COUNT_MASK
+
+    def get_cost(self) -> int:
+        return SIZES[self._size].value + sum(topping.value * self.topping_count(topping) for topping in TOPPINGS)
+
+    def fingerprint(self) -> tuple:
+        return SIZES[self._size], *(self.topping_count(topping) for topping in TOPPINGS)
+
+
+class PizzaBatch:
+
+    """
+    Column oriented batch of pizzas. Sizes are PizzaSize values (cm), toppings are either a matrix with a count column
+    per PizzaTopping or an array of TOPPING_BITS bitmasks.
+    """
+
+    def __init__(self, sizes, toppings):
+        if np is None:
+            raise ImportError("PizzaBatch requires numpy")
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        toppings = np.asarray(toppings, dtype=np.int64)
+        if toppings.ndim == 1:
+            toppings = (toppings[:, None] >> np.arange(len(PizzaTopping))) & 1
+        self.toppings = toppings
+
+    @classmethod
+    def from_pizzas(cls, pizzas: list[Pizza]) -> "PizzaBatch":
+        toppings = np.zeros((len(pizzas), len(PizzaTopping)), dtype=np.int64)
+        for row, pizza in enumerate(pizzas):
+            for topping in pizza.toppings:
+                toppings[row, TOPPING_COLUMNS[topping]] += 1
+        return cls([pizza.size.value for pizza in pizzas], toppings)
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def __getitem__(self, rows) -> "PizzaBatch":
+        return PizzaBatch(self.sizes[rows], self.toppings[rows])
+
+    def has_topping(self, topping: PizzaTopping):
+        return self.toppings[:, TOPPING_COLUMNS[topping]] > 0
+
+    def topping_count(self):
+        return self.toppings.sum(axis=1)
+
+    def get_cost(self):
+        return self.sizes + self.toppings @ np.array([topping.value for topping in PizzaTopping])
+
+    def pizzas(self):
+        # Rows as Pizza objects, toppings come out grouped in PizzaTopping order.
+        for size, counts in zip(self.sizes.tolist(), self.toppings.tolist()):
+            yield Pizza(PizzaSize(size), [topping for topping, count in zip(TOPPINGS, counts) for _ in range(count)])
+
+
+def _defined_in(cls: type, name: str) -> type:
+    return next(klass for klass in cls.__mro__ if name in vars(klass))
+
+
+def _batch_discounts(handlers, batch: PizzaBatch):
+    """
+    Discount per batch row from handlers checked in order, looping with a shrinking set of unsettled rows instead of
+    a frame per handler. match_batch() only stands in for matches() when it was written next to it, other predicates
+    are called row by row. A handler with its own handle() settles all remaining rows with it and ends the loop.
+    """
+    result = np.zeros(len(batch), dtype=np.int64)
+    rows = np.arange(len(batch))
+    for handler in handlers:
+        if not len(rows):
+            break
+        remaining = batch[rows]
+        handler_type = type(handler)
+        if handler_type.handle is not PizzaOrderHandler.handle:
+            result[rows] = np.fromiter((handler.handle(pizza) for pizza in remaining.pizzas()), dtype=np.int64,
+                                       count=len(rows))
+            break
+        if issubclass(_defined_in(handler_type, "match_batch"), _defined_in(handler_type, "matches")):
+            matched = handler.match_batch(remaining)
+        else:
+            matched = np.fromiter((handler.matches(pizza) for pizza in remaining.pizzas()), dtype=bool, count=len(rows))
+        result[rows[matched]] = handler.discount
+        rows = rows[~matched]
+    return result
+
 
 class PizzaOrderHandler:
 
+    discount = 0
+
     def __init__(self, successor=None):
         self.successor = successor
 
+    def matches(self, pizza: Pizza) -> bool:
+        return False
+
     def handle(self, pizza: Pizza) -> int:
+        if self.matches(pizza):
+            return self.discount
         if self.successor is not None:
             return self.successor.handle(pizza)
         return 0
 
+    def match_batch(self, batch: PizzaBatch):
+        return np.zeros(len(batch), dtype=bool)
+
+    def handle_batch(self, batch: PizzaBatch):
+        return _batch_discounts(chain_handlers(self), batch)
+
+    def compile(self) -> "CompiledChain":
+        return CompiledChain(self)
+
 
 class DiscountHandler(PizzaOrderHandler):
 
-    def handle(self, pizza: Pizza) -> int:
-        if pizza.size == PizzaSize.LARGE and PizzaTopping.EXTRA_CHEESE in pizza.toppings:
-            return 2
-        return super().handle(pizza)
+    discount = 2
+
+    def matches(self, pizza: Pizza) -> bool:
+        return pizza.size == PizzaSize.LARGE and PizzaTopping.EXTRA_CHEESE in pizza.toppings
+
+    def match_batch(self, batch: PizzaBatch):
+        return (batch.sizes == PizzaSize.LARGE.value) & batch.has_topping(PizzaTopping.EXTRA_CHEESE)
 
 
 class CouponHandler(PizzaOrderHandler):
 
-    def handle(self, pizza: Pizza) -> int:
-        if len(pizza.toppings) >= 3:
-            return 1
-        return super().handle(pizza)
+    discount = 1
+
+    def matches(self, pizza: Pizza) -> bool:
+        return len(pizza.toppings) >= 3
+
+    def match_batch(self, batch: PizzaBatch):
+        return batch.topping_count() >= 3
 
 
 class DeliveryHandler(PizzaOrderHandler):
 
+    discount = 3
+
+    def matches(self, pizza: Pizza) -> bool:
+        return pizza.size == PizzaSize.MEDIUM or pizza.size == PizzaSize.LARGE
+
+    def match_batch(self, batch: PizzaBatch):
+        return (batch.sizes == PizzaSize.MEDIUM.value) | (batch.sizes == PizzaSize.LARGE.value)
+
+
+class CompiledChain:
+
+    """
+    Flat version of a handler chain: an ordered tuple of (predicate, discount) rules checked in a loop, so evaluation
+    doesn't need a Python frame per handler. A handler that overrides handle() itself can't be split into a rule, it
+    becomes the fallback and settles everything the rules before it didn't match.
+    """
+
+    def __init__(self, handler: PizzaOrderHandler):
+        rules = []
+        # Handlers behind the rules, in order, for handle_batch().
+        handlers = []
+        self.fallback = None
+        while handler is not None:
+            if type(handler).handle is not PizzaOrderHandler.handle:
+                self.fallback = handler
+                handlers.append(handler)
+                break
+            if type(handler).matches is not PizzaOrderHandler.matches:
+                rules.append((handler.matches, handler.discount))
+                handlers.append(handler)
+            handler = handler.successor
+        self.rules = tuple(rules)
+        self.handlers = tuple(handlers)
+
+    def handle(self, pizza: Pizza) -> int:
+        for matches, discount in self.rules:
+            if matches(pizza):
+                return discount
+        if self.fallback is not None:
+            return self.fallback.handle(pizza)
+        return 0
+
+    def handle_batch(self, batch: PizzaBatch):
+        return _batch_discounts(self.handlers, batch)
+
+
+class CachedChain:
+
+    """
+    LRU cache in front of a handler chain (linked or compiled). Discounts only depend on pizza size and toppings, so
+    they are memoized by Pizza.fingerprint(). Call invalidate() after changing the chain.
+    """
+
+    def __init__(self, handler, maxsize: int = 1024):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
     def handle(self, pizza: Pizza) -> int:
-        if pizza.size == PizzaSize.MEDIUM or pizza.size == PizzaSize.LARGE:
-            return 3
-        return super().handle(pizza)
+        key = pizza.fingerprint()
+        try:
+            discount = self._cache[key]
+        except KeyError:
+            self.misses += 1
+            discount = self._cache[key] = self.handler.handle(pizza)
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+            return discount
+        self.hits += 1
+        self._cache.move_to_end(key)
+        return discount
+
+    def invalidate(self) -> None:
+        self._cache.clear()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def chain_handlers(handler: PizzaOrderHandler) -> list[PizzaOrderHandler]:
+    handlers = []
+    while handler is not None:
+        handlers.append(handler)
+        handler = handler.successor
+    return handlers
+
+
+def build_chain(handlers: list[PizzaOrderHandler], tail: PizzaOrderHandler = None) -> PizzaOrderHandler:
+    successor = tail
+    for handler in reversed(handlers):
+        handler.successor = successor
+        successor = handler
+    return successor
+
+
+class HandlerStats:
+
+    __slots__ = ("handler", "invoked", "matched", "elapsed_ns")
+
+    def __init__(self, handler: PizzaOrderHandler):
+        self.handler = handler
+        self.invoked = 0
+        self.matched = 0
+        self.elapsed_ns = 0
+
+    @property
+    def match_rate(self) -> float:
+        return self.matched / self.invoked if self.invoked else 0.0
+
+    @property
+    def mean_ns(self) -> float:
+        return self.elapsed_ns / self.invoked if self.invoked else 0.0
+
+
+class ChainInstrumentation:
+
+    """
+    Counts invocations, matches and predicate time per handler of a chain. Enabling shadows each handler's matches()
+    with a timed wrapper on the instance, disabling removes it again, so a chain that isn't instrumented pays nothing.
+    CompiledChain binds predicates when compiled, compile after enabling to instrument it.
+    """
+
+    def __init__(self, handler: PizzaOrderHandler):
+        self.handlers = chain_handlers(handler)
+        self.stats = [HandlerStats(handler) for handler in self.handlers]
+        self.enabled = False
+
+    def __enter__(self) -> "ChainInstrumentation":
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.disable()
+
+    def enable(self) -> None:
+        if self.enabled:
+            return
+        for handler, stats in zip(self.handlers, self.stats):
+            handler.matches = self._timed(handler.matches, stats)
+        self.enabled = True
+
+    def disable(self) -> None:
+        for handler in self.handlers:
+            vars(handler).pop("matches", None)
+        self.enabled = False
+
+    def reset(self) -> None:
+        self.stats = [HandlerStats(handler) for handler in self.handlers]
+        if self.enabled:
+            self.disable()
+            self.enable()
+
+    @staticmethod
+    def _timed(matches, stats: HandlerStats):
+        def timed_matches(pizza: Pizza) -> bool:
+            start = time.perf_counter_ns()
+            matched = matches(pizza)
+            stats.elapsed_ns += time.perf_counter_ns() - start
+            stats.invoked += 1
+            if matched:
+                stats.matched += 1
+            return matched
+        return timed_matches
+
+    def report(self) -> list[dict]:
+        return [
+            {
+                "position": position,
+                "handler": type(stats.handler).__name__,
+                "invoked": stats.invoked,
+                "matched": stats.matched,
+                "match_rate": stats.match_rate,
+                "mean_ns": stats.mean_ns,
+            }
+            for position, stats in enumerate(self.stats)
+        ]
+
+    def format_report(self) -> str:
+        lines = [f"{'#':>2} {'handler':<20} {'invoked':>8} {'matched':>8} {'rate':>6} {'mean ns':>9}"]
+        for row in self.report():
+            lines.append(
+                f"{row['position']:>2} {row['handler']:<20} {row['invoked']:>8} {row['matched']:>8} "
+                f"{row['match_rate']:>6.1%} {row['mean_ns']:>9.0f}"
+            )
+        return "\n".join(lines)
+
+    def suggest_order(self, pizzas: list[Pizza], trust_sample: bool = False) -> list[PizzaOrderHandler]:
+        """
+        Order the rule handlers so cheap, selective predicates run first, measured by running every predicate over the
+        sample pizzas. Only handlers with the same discount are moved past each other, so the suggestion gives the
+        same results as the current chain for any pizza. With trust_sample, handlers with different discounts may swap
+        too when no sample pizza matches both, which is only safe if the sample covers every kind of pizza ordered.
+        Handlers with their own handle() and everything after them are left out, they stay at the end of the chain.
+        """
+        handlers = []
+        for handler in self.handlers:
+            if type(handler).handle is not PizzaOrderHandler.handle:
+                break
+            handlers.append(handler)
+        matches, costs = [], []
+        for handler in handlers:
+            predicate = type(handler).matches.__get__(handler)
+            start = time.perf_counter_ns()
+            matches.append([predicate(pizza) for pizza in pizzas])
+            costs.append((time.perf_counter_ns() - start) / max(len(pizzas), 1))
+        # Handler index -> indexes of the earlier handlers it has to stay behind.
+        blocked_by = {
+            later: {
+                earlier for earlier in range(later)
+                if handlers[earlier].discount != handlers[later].discount
+                and (not trust_sample or any(a and b for a, b in zip(matches[earlier], matches[later])))
+            }
+            for later in range(len(handlers))
+        }
+        order, placed = [], set()
+        while len(order) < len(handlers):
+            available = [index for index in range(len(handlers)) if index not in placed and blocked_by[index] <= placed]
+            best = min(available, key=lambda index: costs[index] / max(sum(matches[index]) / max(len(pizzas), 1), 1e-9))
+            order.append(best)
+            placed.add(best)
+        return [handlers[index] for index in order]
+
+
+def price_batch(batch: PizzaBatch, handler: PizzaOrderHandler):
+    costs = batch.get_cost()
+    discounts = handler.handle_batch(batch)
+    return costs - discounts, discounts
+
+
+def check_batch_equivalence(handler: PizzaOrderHandler, batch: PizzaBatch) -> None:
+    expected = [handler.handle(pizza) for pizza in batch.pizzas()]
+    actual = handler.handle_batch(batch).tolist()
+    mismatches = [row for row, (a, b) in enumerate(zip(expected, actual)) if a != b]
+    if mismatches:
+        raise AssertionError(f"handle_batch() differs from handle() in rows {mismatches[:10]}")
 
 
 def example():
@@ -92,6 +517,54 @@ def example():
 
     print(f"Total cost of pizza: {total_cost}")
 
+    compact_pizza = CompactPizza.from_pizza(pizza)
+    print(f"Total cost of compact pizza: {compact_pizza.get_cost() - delivery_handler.handle(compact_pizza)}")
+
+    with ChainInstrumentation(delivery_handler) as instrumentation:
+        for sample in [pizza, Pizza(PizzaSize.SMALL, [PizzaTopping.MUSHROOM] * 3), Pizza(PizzaSize.SMALL, [])]:
+            delivery_handler.handle(sample)
+    print(instrumentation.format_report())
+
+    cached_handler = CachedChain(delivery_handler.compile(), maxsize=128)
+    for _ in range(100):
+        cached_handler.handle(pizza)
+    print(f"Cached chain hit rate: {cached_handler.hit_rate():.0%}")
+
+    if np is not None:
+        batch = PizzaBatch(
+            [PizzaSize.LARGE.value, PizzaSize.SMALL.value],
+            [TOPPING_BITS[PizzaTopping.PEPPERONI] | TOPPING_BITS[PizzaTopping.EXTRA_CHEESE], 0],
+        )
+        costs, discounts = price_batch(batch, delivery_handler)
+        print(f"Batch costs: {costs.tolist()}, discounts: {discounts.tolist()}")
+
+        # Every size with every mix of up to 3 toppings, checked against handle() for each row.
+        combinations = [(size.value, counts) for size in PizzaSize
+                        for counts in np.ndindex(*(4,) * len(PizzaTopping)) if sum(counts) <= 3]
+        check_batch_equivalence(delivery_handler, PizzaBatch(*zip(*combinations)))
+
+
+def benchmark(depths=(10, 100, 1000), number=1000):
+    handler_types = [DiscountHandler, CouponHandler, DeliveryHandler]
+    # Small pizza with a single topping falls through every handler, the worst case for a chain.
+    pizza = Pizza(PizzaSize.SMALL, [PizzaTopping.MUSHROOM])
+    for depth in depths:
+        chain = None
+        for index in range(depth):
+            chain = handler_types[index % len(handler_types)](chain)
+        compiled = chain.compile()
+        compiled_time = timeit.timeit(lambda: compiled.handle(pizza), number=number)
+        # The linked chain needs a frame per handler, deep chains only run with a raised recursion limit.
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursion_limit, depth + 100))
+        try:
+            linked_time = timeit.timeit(lambda: chain.handle(pizza), number=number)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+        print(f"depth {depth:>5}: linked {linked_time / number * 1e6:.2f}us, compiled {compiled_time / number * 1e6:.2f}us")
+
 
 if __name__ == "__main__":
     example()
+    if "--benchmark" in sys.argv:
+        benchmark()
@@ -21,34 +21,72 @@ without changing existing code, as well as queue commands for later execution or
 """
 
 
+import mmap
+import os
+import struct
 from abc import ABC, abstractmethod
+from collections import Counter, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import pizza_events as events
 
 
 class Pizza:
 
-    def __init__(self, name):
+    next_id = 0
+
+    def __init__(self, name, id_: int = None):
+        # Name is the kind of pizza, id_ tells apart pizzas of the same kind, the journal keys pizzas on it.
+        if id_ is None:
+            id_ = Pizza.next_id
+        Pizza.next_id = max(Pizza.next_id, id_ + 1)
+        self.id_ = id_
         self.name = name
-        self.toppings = []
+        # Topping -> count, so adding and removing a topping are both O(1).
+        self.toppings = Counter()
 
     def add_topping(self, topping: str) -> None:
-        self.toppings.append(topping)
-        print(f"{topping} added to {self.name} pizza")
+        self.toppings[topping] += 1
+        events.emit("pizza.topping_added", "{topping} added to {name} pizza", topping=topping, name=self.name)
 
     def remove_topping(self, topping: str) -> None:
-        self.toppings.remove(topping)
-        print(f"{topping} removed from {self.name} pizza")
+        count = self.toppings[topping]
+        if not count:
+            raise ValueError(f"{topping} is not on {self.name} pizza")
+        if count == 1:
+            del self.toppings[topping]
+        else:
+            self.toppings[topping] = count - 1
+        events.emit("pizza.topping_removed", "{topping} removed from {name} pizza", topping=topping, name=self.name)
+
+    def add_toppings(self, toppings: list[str]) -> None:
+        self.toppings.update(toppings)
+        events.emit("pizza.toppings_added", "{toppings} added to {name} pizza", toppings=events.Joined(toppings),
+                    name=self.name)
+
+    def remove_toppings(self, toppings: list[str]) -> None:
+        removed = Counter(toppings)
+        for topping, count in removed.items():
+            if self.toppings[topping] < count:
+                raise ValueError(f"{topping} is not on {self.name} pizza {count} times")
+        self.toppings.subtract(removed)
+        for topping in removed:
+            if not self.toppings[topping]:
+                del self.toppings[topping]
+        events.emit("pizza.toppings_removed", "{toppings} removed from {name} pizza", toppings=events.Joined(toppings),
+                    name=self.name)
 
     def get_toppings(self) -> list:
-        return self.toppings
+        return list(self.toppings.elements())
 
     def bake(self) -> None:
-        print(f"{self.name} pizza is baking")
+        events.emit("pizza.baking", "{name} pizza is baking", name=self.name)
 
     def cut(self) -> None:
-        print(f"{self.name} pizza is being cut")
+        events.emit("pizza.cutting", "{name} pizza is being cut", name=self.name)
 
     def box(self) -> None:
-        print(f"{self.name} pizza is being boxed")
+        events.emit("pizza.boxing", "{name} pizza is being boxed", name=self.name)
 
 
 class Command(ABC):
@@ -57,9 +95,25 @@ class Command(ABC):
     def execute(self) -> None:
         pass
 
+    def inverse(self):
+        # Commands without an inverse, like baking, can't be undone.
+        return None
+
+    def undo(self) -> None:
+        inverse = self.inverse()
+        if inverse is None:
+            raise TypeError(f"{type(self).__name__} can't be undone")
+        inverse.execute()
+
+    @property
+    def receiver(self):
+        return getattr(self, "pizza", None)
+
 
 class AddToppingCommand(Command):
 
+    code = 1
+
     def __init__(self, pizza, topping):
         self.pizza = pizza
         self.topping = topping
@@ -67,9 +121,14 @@ class AddToppingCommand(Command):
     def execute(self) -> None:
         self.pizza.add_topping(self.topping)
 
+    def inverse(self) -> "RemoveToppingCommand":
+        return RemoveToppingCommand(self.pizza, self.topping)
+
 
 class RemoveToppingCommand(Command):
 
+    code = 2
+
     def __init__(self, pizza, topping):
         self.pizza = pizza
         self.topping = topping
@@ -77,9 +136,49 @@ class RemoveToppingCommand(Command):
     def execute(self) -> None:
         self.pizza.remove_topping(self.topping)
 
+    def inverse(self) -> AddToppingCommand:
+        return AddToppingCommand(self.pizza, self.topping)
+
+
+class AddToppingsCommand(Command):
+
+    def __init__(self, pizza, toppings):
+        self.pizza = pizza
+        self.toppings = list(toppings)
+
+    @property
+    def commands(self) -> list[AddToppingCommand]:
+        return [AddToppingCommand(self.pizza, topping) for topping in self.toppings]
+
+    def execute(self) -> None:
+        self.pizza.add_toppings(self.toppings)
+
+    def inverse(self) -> "RemoveToppingsCommand":
+        return RemoveToppingsCommand(self.pizza, self.toppings)
+
+
+class RemoveToppingsCommand(Command):
+
+    def __init__(self, pizza, toppings):
+        self.pizza = pizza
+        self.toppings = list(toppings)
+
+    @property
+    def commands(self) -> list[RemoveToppingCommand]:
+        return [RemoveToppingCommand(self.pizza, topping) for topping in self.toppings]
+
+    def execute(self) -> None:
+        self.pizza.remove_toppings(self.toppings)
+
+    def inverse(self) -> AddToppingsCommand:
+        return AddToppingsCommand(self.pizza, self.toppings)
+
 
 class BakePizzaCommand(Command):
 
+    code = 3
+    idempotent = True
+
     def __init__(self, pizza):
         self.pizza = pizza
 
@@ -89,6 +188,9 @@ class BakePizzaCommand(Command):
 
 class CutPizzaCommand(Command):
 
+    code = 4
+    idempotent = True
+
     def __init__(self, pizza):
         self.pizza = pizza
 
@@ -98,6 +200,9 @@ class CutPizzaCommand(Command):
 
 class BoxPizzaCommand(Command):
 
+    code = 5
+    idempotent = True
+
     def __init__(self, pizza):
         self.pizza = pizza
 
@@ -105,18 +210,407 @@ class BoxPizzaCommand(Command):
         self.pizza.box()
 
 
+COMMAND_TYPES = {
+    command_type.code: command_type
+    for command_type in (AddToppingCommand, RemoveToppingCommand, BakePizzaCommand, CutPizzaCommand, BoxPizzaCommand)
+}
+
+
+def _replay_add(pizza: Pizza, topping: str) -> None:
+    pizza.toppings[topping] += 1
+
+
+def _replay_remove(pizza: Pizza, topping: str) -> None:
+    # Removing a missing topping failed when it was executed too, the state didn't change.
+    count = pizza.toppings[topping]
+    if count == 1:
+        del pizza.toppings[topping]
+    elif count:
+        pizza.toppings[topping] = count - 1
+
+
+# Command code -> state change applied on replay, commands missing here don't change Pizza state.
+REPLAY_ACTIONS = {
+    AddToppingCommand.code: _replay_add,
+    RemoveToppingCommand.code: _replay_remove,
+}
+
+
+class CommandJournal:
+
+    """
+    Append-only binary journal of executed commands. Every record is a (code, pizza id, name length, topping length)
+    header followed by the UTF-8 pizza name and topping, pizzas are identified by Pizza.id_. Commands are journaled
+    only after they executed successfully, so replay never applies a command that didn't run. Records are buffered and
+    written with a single write and fsync once group_size of them are pending (group commit). A snapshot of the
+    journaled pizzas is written next to the journal together with the journal offset it covers, replay() loads it and
+    memory-maps only the rest.
+    """
+
+    RECORD = struct.Struct("<BQHH")
+    SNAPSHOT_HEADER = struct.Struct("<QI")
+    ID = struct.Struct("<Q")
+    COUNT = struct.Struct("<I")
+    LENGTH = struct.Struct("<H")
+
+    def __init__(self, path: str, group_size: int = 256, snapshot_every: int = 100_000, pizzas: dict = None):
+        # Pass the result of replay() as pizzas when reopening a journal, so later snapshots still cover them.
+        self.path = path
+        self.snapshot_path = f"{path}.snapshot"
+        self.group_size = group_size
+        self.snapshot_every = snapshot_every
+        self.pizzas = pizzas if pizzas is not None else {}
+        self._file = open(path, "ab")
+        self._buffer = bytearray()
+        self._pending = 0
+        self._since_snapshot = 0
+
+    def __enter__(self) -> "CommandJournal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def append(self, command: Command) -> None:
+        if hasattr(command, "commands"):
+            # Bulk commands are journaled as the single commands they stand for.
+            for single_command in command.commands:
+                self.append(single_command)
+            return
+        if getattr(command, "code", None) not in COMMAND_TYPES:
+            raise TypeError(f"{type(command).__name__} can't be journaled")
+        pizza = command.receiver
+        self.pizzas[pizza.id_] = pizza
+        name = pizza.name.encode()
+        topping = getattr(command, "topping", "").encode()
+        self._buffer += self.RECORD.pack(command.code, pizza.id_, len(name), len(topping))
+        self._buffer += name
+        self._buffer += topping
+        self._pending += 1
+        if self._pending >= self.group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        self._file.write(self._buffer)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._since_snapshot += self._pending
+        self._buffer.clear()
+        self._pending = 0
+
+    def maybe_snapshot(self) -> None:
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self) -> None:
+        self.flush()
+        data = bytearray(self.SNAPSHOT_HEADER.pack(self._file.tell(), len(self.pizzas)))
+        for id_, pizza in self.pizzas.items():
+            data += self.ID.pack(id_)
+            data += self._pack_str(pizza.name)
+            data += self.COUNT.pack(len(pizza.toppings))
+            for topping, count in pizza.toppings.items():
+                data += self._pack_str(topping)
+                data += self.COUNT.pack(count)
+        temporary_path = f"{self.snapshot_path}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.snapshot_path)
+        self._since_snapshot = 0
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+    @classmethod
+    def _pack_str(cls, value: str) -> bytes:
+        encoded = value.encode()
+        return cls.LENGTH.pack(len(encoded)) + encoded
+
+    @classmethod
+    def _unpack_str(cls, data, offset: int) -> tuple[str, int]:
+        length, = cls.LENGTH.unpack_from(data, offset)
+        offset += cls.LENGTH.size
+        return bytes(data[offset:offset + length]).decode(), offset + length
+
+    @classmethod
+    def load_snapshot(cls, snapshot_path: str) -> tuple[dict, int]:
+        if not os.path.exists(snapshot_path):
+            return {}, 0
+        with open(snapshot_path, "rb") as file:
+            data = file.read()
+        journal_offset, count = cls.SNAPSHOT_HEADER.unpack_from(data)
+        offset = cls.SNAPSHOT_HEADER.size
+        pizzas = {}
+        for _ in range(count):
+            id_, = cls.ID.unpack_from(data, offset)
+            name, offset = cls._unpack_str(data, offset + cls.ID.size)
+            toppings_count, = cls.COUNT.unpack_from(data, offset)
+            offset += cls.COUNT.size
+            pizza = pizzas[id_] = Pizza(name, id_)
+            for _ in range(toppings_count):
+                topping, offset = cls._unpack_str(data, offset)
+                pizza.toppings[topping], = cls.COUNT.unpack_from(data, offset)
+                offset += cls.COUNT.size
+        return pizzas, journal_offset
+
+    @classmethod
+    def replay(cls, path: str) -> dict[int, Pizza]:
+        pizzas, offset = cls.load_snapshot(f"{path}.snapshot")
+        if not os.path.exists(path) or os.path.getsize(path) <= offset:
+            return pizzas
+        unpack_record = cls.RECORD.unpack_from
+        header_size = cls.RECORD.size
+        with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            end = len(data)
+            while offset + header_size <= end:
+                code, id_, name_length, topping_length = unpack_record(data, offset)
+                name_start = offset + header_size
+                topping_start = name_start + name_length
+                record_end = topping_start + topping_length
+                if record_end > end:
+                    # Torn write at the tail of the journal, the record was never committed.
+                    break
+                pizza = pizzas.get(id_)
+                if pizza is None:
+                    pizza = pizzas[id_] = Pizza(data[name_start:topping_start].decode(), id_)
+                action = REPLAY_ACTIONS.get(code)
+                if action is not None:
+                    action(pizza, data[topping_start:record_end].decode())
+                offset = record_end
+        return pizzas
+
+
+class CommandResult:
+
+    __slots__ = ("command", "result", "error")
+
+    def __init__(self, command: Command, result=None, error: Exception = None):
+        self.command = command
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class OptimizationReport:
+
+    __slots__ = ("before", "cancelled", "collapsed", "merged")
+
+    def __init__(self, before: int):
+        self.before = before
+        self.cancelled = 0
+        self.collapsed = 0
+        self.merged = 0
+
+    @property
+    def removed(self) -> int:
+        return self.cancelled + self.collapsed + self.merged
+
+    @property
+    def after(self) -> int:
+        return self.before - self.removed
+
+    def __repr__(self) -> str:
+        return (f"OptimizationReport(before={self.before}, after={self.after}, cancelled={self.cancelled}, "
+                f"collapsed={self.collapsed}, merged={self.merged})")
+
+
+def optimize_commands(commands: list[Command]) -> tuple[list[Command], OptimizationReport]:
+    """
+    Drops commands that can't change the final state of their receivers:
+
+        *   An AddToppingCommand and a later RemoveToppingCommand of the same topping on the same pizza cancel out,
+            they are paired like brackets, so every remove that could fail still sees the same topping count.
+            Pairs only span commands that can't raise: any other command on that pizza, including a remove without
+            a matching add that might fail and stop execute_commands(), ends the pairing.
+        *   Repeats of an idempotent command on the same pizza, like a second BakePizzaCommand, are collapsed when
+            no other command ran on that pizza in between.
+        *   Runs of AddToppingCommand on the same pizza with nothing else on that pizza in between are merged into
+            one AddToppingsCommand. The run becomes a single entry in the undo history, one undo() reverts all of it.
+
+    Commands on different receivers are independent, so only the order per receiver matters.
+    """
+    report = OptimizationReport(len(commands))
+    kept = [True] * len(commands)
+
+    open_adds = {}
+    # Receiver -> type of the last command on it, only while that was an idempotent one.
+    last_idempotent = {}
+    for position, command in enumerate(commands):
+        receiver = id(command.receiver)
+        if getattr(command, "idempotent", False):
+            open_adds.pop(receiver, None)
+            if last_idempotent.get(receiver) is type(command):
+                kept[position] = False
+                report.collapsed += 1
+            last_idempotent[receiver] = type(command)
+            continue
+        last_idempotent.pop(receiver, None)
+        if type(command) is AddToppingCommand:
+            open_adds.setdefault(receiver, {}).setdefault(command.topping, []).append(position)
+        elif type(command) is RemoveToppingCommand:
+            adds = open_adds.get(receiver, {}).get(command.topping)
+            if adds:
+                kept[adds.pop()] = False
+                kept[position] = False
+                report.cancelled += 2
+            else:
+                open_adds.pop(receiver, None)
+        else:
+            open_adds.pop(receiver, None)
+
+    optimized = []
+    all_runs = []
+    open_runs = {}
+    for position, command in enumerate(commands):
+        if not kept[position]:
+            continue
+        receiver = id(command.receiver)
+        if type(command) is AddToppingCommand:
+            run = open_runs.get(receiver)
+            if run is None:
+                run = open_runs[receiver] = (len(optimized), [])
+                all_runs.append(run)
+                optimized.append(command)
+            else:
+                report.merged += 1
+            run[1].append(command.topping)
+            continue
+        open_runs.pop(receiver, None)
+        optimized.append(command)
+    for index, toppings in all_runs:
+        if len(toppings) > 1:
+            optimized[index] = AddToppingsCommand(optimized[index].pizza, toppings)
+    return optimized, report
+
+
+def _execute_stream(commands: list[Command]) -> tuple[list[tuple], object]:
+    outcomes = []
+    for command in commands:
+        try:
+            outcomes.append((command.execute(), None))
+        except Exception as exc:
+            outcomes.append((None, exc))
+    # Receiver is sent back so process pools can copy its state into the parent's object.
+    return outcomes, commands[0].receiver
+
+
 class PizzaChef:
 
-    def __init__(self):
+    def __init__(self, journal: CommandJournal = None, history_size: int = 100):
         self.commands = []
+        self.journal = journal
+        # Bounded, so the oldest executed commands fall off and can no longer be undone.
+        self.undo_history = deque(maxlen=history_size)
+        self.redo_history = deque(maxlen=history_size)
 
     def add_command(self, command: Command) -> None:
         self.commands.append(command)
 
-    def execute_commands(self) -> None:
-        for command in self.commands:
-            command.execute()
+    def optimize_commands(self) -> OptimizationReport:
+        self.commands, report = optimize_commands(self.commands)
+        return report
+
+    def execute_commands(self, optimize: bool = False) -> None:
+        if optimize:
+            self.optimize_commands()
+        executed = 0
+        try:
+            for command in self.commands:
+                command.execute()
+                executed += 1
+                self._record(command)
+                if self.journal is not None:
+                    self.journal.append(command)
+        finally:
+            # After a failure the failed command and everything after it stay queued, nothing of it was journaled.
+            del self.commands[:executed]
+            if self.journal is not None:
+                self.journal.flush()
+        if self.journal is not None:
+            self.journal.maybe_snapshot()
+
+    def _record(self, command: Command) -> None:
+        self.redo_history.clear()
+        if command.inverse() is None:
+            # Nothing before an irreversible command can be undone any more.
+            self.undo_history.clear()
+        else:
+            self.undo_history.append(command)
+
+    def _run(self, command: Command) -> None:
+        command.execute()
+        if self.journal is not None:
+            self.journal.append(command)
+            self.journal.flush()
+
+    def undo(self) -> bool:
+        if not self.undo_history:
+            return False
+        command = self.undo_history.pop()
+        self._run(command.inverse())
+        self.redo_history.append(command)
+        return True
+
+    def redo(self) -> bool:
+        if not self.redo_history:
+            return False
+        command = self.redo_history.pop()
+        self._run(command)
+        self.undo_history.append(command)
+        return True
+
+    def execute_commands_parallel(self, executor: Executor = None, max_workers: int = None,
+                                  optimize: bool = False) -> list[CommandResult]:
+        """
+        Commands are split into one ordered stream per receiver and the streams run concurrently, so commands on
+        the same pizza keep their order. A failing command doesn't stop its stream, every command gets a
+        CommandResult in the original queue order. With a ProcessPoolExecutor the receivers are pickled, their state
+        is copied back after the stream finished.
+        """
+        if optimize:
+            self.optimize_commands()
+        streams = {}
+        for position, command in enumerate(self.commands):
+            streams.setdefault(id(command.receiver), []).append((position, command))
+        results = [None] * len(self.commands)
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = [
+                (stream, executor.submit(_execute_stream, [command for _, command in stream]))
+                for stream in streams.values()
+            ]
+            for stream, future in futures:
+                outcomes, receiver = future.result()
+                original_receiver = stream[0][1].receiver
+                if isinstance(executor, ProcessPoolExecutor) and original_receiver is not None:
+                    vars(original_receiver).update(vars(receiver))
+                for (position, command), (result, error) in zip(stream, outcomes):
+                    results[position] = CommandResult(command, result, error)
+        finally:
+            if own_executor:
+                executor.shutdown()
+        # Undoing in reverse queue order reverses every receiver's stream, whatever the interleaving was.
+        # Journaled in queue order too, every receiver's commands keep the order they ran in.
+        for result in results:
+            if result.ok:
+                self._record(result.command)
+                if self.journal is not None:
+                    self.journal.append(result.command)
         self.commands.clear()
+        if self.journal is not None:
+            self.journal.flush()
+            self.journal.maybe_snapshot()
+        return results
 
 
 def example():
@@ -137,6 +631,29 @@ def example():
 
     print(pepperoni_pizza.get_toppings())
 
+    mushroom_pizza = Pizza("Mushroom")
+    for pizza in (pepperoni_pizza, mushroom_pizza):
+        chef.add_command(AddToppingCommand(pizza, "Mushroom"))
+        chef.add_command(RemoveToppingCommand(pizza, "Pepperoni"))
+    results = chef.execute_commands_parallel(max_workers=2)
+    print([result.ok for result in results])
+
+    chef.add_command(AddToppingCommand(mushroom_pizza, "Olives"))
+    chef.add_command(AddToppingCommand(mushroom_pizza, "Olives"))
+    chef.execute_commands()
+    chef.undo()
+    print(mushroom_pizza.get_toppings())
+    chef.redo()
+    print(mushroom_pizza.get_toppings())
+
+    for topping in ("Onion", "Ham", "Onion", "Basil"):
+        chef.add_command(AddToppingCommand(mushroom_pizza, topping))
+    chef.add_command(RemoveToppingCommand(mushroom_pizza, "Onion"))
+    chef.add_command(BakePizzaCommand(mushroom_pizza))
+    chef.add_command(BakePizzaCommand(mushroom_pizza))
+    print(chef.optimize_commands())
+    chef.execute_commands()
+
 
 if __name__ == '__main__':
     example()
@@ -13,14 +13,24 @@ they implement a common interface.
 """
 
 
+import asyncio
+import collections
 import enum
+import heapq
+import inspect
 import itertools
+import operator
+import weakref
+from typing import Callable, Iterable, Union
+
+import pizza_events as events
 
 
 class OrderStatus(enum.Enum):
 
     PREPARING = "Preparing"
     BACKING = "Backing"
+    DELIVERED = "Delivered"
 
 
 class Observer:
@@ -29,19 +39,154 @@ class Observer:
         raise NotImplementedError
 
 
-class Subject:
+class AsyncDispatcher:
+
+    """
+    Delivers notifications from background asyncio tasks instead of inside the state change. Every subject gets at most
+    one delivery task at a time, changes that land while it is running only bump the subject's version, so an observer
+    that has not been reached yet is called once and sees the latest state. Concurrent update calls are capped by
+    a semaphore shared by all subjects using this dispatcher.
+
+    The dispatcher is bound to one event loop, the one passed to start() or the running loop it is first used from.
+    Changes made from other threads, or before that loop runs, are handed over to it with call_soon_threadsafe. Once
+    the loop is closed and nothing is pending, the next running loop that uses the dispatcher takes over.
+    """
+
+    def __init__(self, max_concurrency: int = 10):
+        self._max_concurrency = max_concurrency
+        self._loop = None
+        self._semaphore = None
+        self._versions = {}
+        self._workers = {}
+
+    def start(self, loop: asyncio.AbstractEventLoop = None) -> None:
+        self._bind(loop or asyncio.get_running_loop())
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is None or self._loop.is_closed() or (running not in (None, self._loop) and not self._workers):
+            if running is None:
+                raise RuntimeError("AsyncDispatcher has no event loop, call start() or use it from a running loop")
+            self._bind(running)
+        return self._loop
+
+    def schedule(self, subject: "Subject", status=None) -> None:
+        loop = self.loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._schedule(subject, status)
+        else:
+            loop.call_soon_threadsafe(self._schedule, subject, status)
+
+    async def drain(self) -> None:
+        # Yielding first lets changes handed over from other threads reach _schedule.
+        await asyncio.sleep(0)
+        while self._workers:
+            await asyncio.gather(*self._workers.values())
+            await asyncio.sleep(0)
+
+    def _bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        # The semaphore belongs to the loop it is first used on, _deliver creates a new one for the new loop.
+        self._semaphore = None
+
+    def _schedule(self, subject: "Subject", status) -> None:
+        version, _ = self._versions.get(subject, (0, None))
+        self._versions[subject] = (version + 1, status)
+        if subject not in self._workers:
+            self._workers[subject] = self._loop.create_task(self._deliver(subject))
+
+    async def _deliver(self, subject: "Subject") -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        delivered = {}
+        try:
+            while True:
+                version, status = self._versions[subject]
+                pending = [observer for observer in subject.subscribers(status) if delivered.get(observer) != version]
+                if not pending:
+                    break
+                await asyncio.gather(*(self._deliver_one(subject, observer, delivered) for observer in pending))
+        finally:
+            del self._workers[subject]
+            del self._versions[subject]
+
+    async def _deliver_one(self, subject: "Subject", observer: "Observer", delivered: dict) -> None:
+        async with self._semaphore:
+            delivered[observer], _ = self._versions[subject]
+            try:
+                result = observer.update(subject)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as exc:
+                asyncio.get_running_loop().call_exception_handler({
+                    "message": f"Observer {observer!r} failed to handle update",
+                    "exception": exc,
+                })
+
+
+StatusFilter = Union[Iterable, Callable[[object], bool], None]
 
-    def __init__(self):
-        self._observers = []
 
-    def attach(self, observer: Observer) -> None:
-        self._observers.append(observer)
+class Subject:
+
+    def __init__(self, dispatcher: AsyncDispatcher = None):
+        # Insertion ordered and weakly referenced, observers that got garbage collected drop out on their own.
+        # Observer -> its filter, the attach sequence number is kept in the indexes below.
+        self._observers = weakref.WeakKeyDictionary()
+        self._unfiltered = weakref.WeakKeyDictionary()
+        self._predicated = weakref.WeakKeyDictionary()
+        self._by_status = {}
+        self._attach_seq = itertools.count()
+        self._dispatcher = dispatcher
+
+    def attach(self, observer: Observer, statuses: StatusFilter = None) -> None:
+        if observer in self._observers:
+            self.detach(observer)
+        seq = next(self._attach_seq)
+        if statuses is None:
+            self._unfiltered[observer] = seq
+        elif callable(statuses):
+            self._predicated[observer] = seq
+        else:
+            statuses = frozenset(statuses)
+            for status in statuses:
+                self._by_status.setdefault(status, weakref.WeakKeyDictionary())[observer] = seq
+        self._observers[observer] = statuses
 
     def detach(self, observer: Observer) -> None:
-        self._observers.remove(observer)
-
-    def notify(self) -> None:
-        for observer in self._observers:
+        statuses = self._observers.pop(observer)
+        if statuses is None:
+            del self._unfiltered[observer]
+        elif callable(statuses):
+            del self._predicated[observer]
+        else:
+            for status in statuses:
+                del self._by_status[status][observer]
+
+    def subscribers(self, status=None) -> list[Observer]:
+        runs = [list(self._unfiltered.items())]
+        if self._predicated:
+            runs.append([(observer, seq) for observer, seq in list(self._predicated.items())
+                         if self._observers[observer](status)])
+        if status in self._by_status:
+            runs.append(list(self._by_status[status].items()))
+        if len(runs) == 1:
+            return [observer for observer, _ in runs[0]]
+        # Every index is ordered by attach sequence, merging them keeps the overall attach order.
+        return [observer for observer, _ in heapq.merge(*runs, key=operator.itemgetter(1))]
+
+    def notify(self, status=None) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.schedule(self, status)
+            return
+        for observer in self.subscribers(status):
             observer.update(self)
 
 
@@ -49,8 +194,8 @@ class PizzaOrder(Subject):
 
     id_iter = itertools.count()
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, dispatcher: AsyncDispatcher = None):
+        super().__init__(dispatcher)
         self.id_ = next(PizzaOrder.id_iter)
         self._order_status = None
 
@@ -60,8 +205,11 @@ class PizzaOrder(Subject):
 
     @order_status.setter
     def order_status(self, status: OrderStatus) -> None:
+        if self._dispatcher is not None:
+            # Fails before the status changes, observers can not miss a change that did happen.
+            self._dispatcher.loop()
         self._order_status = status
-        self.notify()
+        self.notify(status)
 
 
 class Customer(Observer):
@@ -70,23 +218,64 @@ class Customer(Observer):
         self._name = name
 
     def update(self, order: PizzaOrder) -> None:
-        print(f"{self._name} received the message: Order {order.id_} status change to: {order.order_status.value}")
+        events.emit(
+            "order.status_received", "{name} received the message: Order {order_id} status change to: {status}",
+            name=self._name, order_id=order.id_, status=order.order_status.value,
+        )
 
 
 class Kitchen(Observer):
 
+    TERMINAL_STATUSES = frozenset({OrderStatus.DELIVERED})
+
     def __init__(self):
-        self._orders_in_progress = set()
+        # Status -> orders in that status, in arrival order so the first key is the oldest order. OrderedDict because
+        # orders leave from the front, a plain dict keeps their deleted slots and next(iter()) has to skip over them.
+        self._orders_by_status = {}
+        self._order_statuses = {}
+        # Order -> None, ordered by the time the kitchen first saw the order.
+        self._orders_in_progress = collections.OrderedDict()
+        self._summary = None
 
     def update(self, order: PizzaOrder) -> None:
-        self._orders_in_progress.add(order)
-        print(f"New order received. Orders in progress: {', '.join(str(order.id_) for order in self._orders_in_progress)}")
+        previous = self._order_statuses.get(order)
+        status = order.order_status
+        if previous == status:
+            return
+        if previous is not None:
+            del self._orders_by_status[previous][order]
+        if status in self.TERMINAL_STATUSES:
+            self._order_statuses.pop(order, None)
+            self._orders_in_progress.pop(order, None)
+        else:
+            if previous is None:
+                events.emit("kitchen.order_received", "New order received: {order_id}", order_id=order.id_)
+            self._order_statuses[order] = status
+            self._orders_by_status.setdefault(status, collections.OrderedDict())[order] = None
+            self._orders_in_progress.setdefault(order)
+        self._summary = None
+
+    def orders_in_progress(self) -> list[PizzaOrder]:
+        return list(self._orders_in_progress)
+
+    def count(self, status: OrderStatus) -> int:
+        return len(self._orders_by_status.get(status, ()))
+
+    def oldest_order(self, status: OrderStatus = None) -> PizzaOrder:
+        orders = self._orders_in_progress if status is None else self._orders_by_status.get(status, {})
+        return next(iter(orders), None)
+
+    def summary(self) -> str:
+        if self._summary is None:
+            self._summary = f"Orders in progress: {', '.join(str(order.id_) for order in self._orders_in_progress)}"
+        return self._summary
 
 
 def example():
     customer1 = Customer("John")
     customer2 = Customer("Jane")
     customer3 = Customer("Jack")
+    customer4 = Customer("Jill")
     kitchen = Kitchen()
 
     order0 = PizzaOrder()
@@ -95,7 +284,8 @@ def example():
     order0.attach(kitchen)
 
     order1 = PizzaOrder()
-    order1.attach(customer3)
+    order1.attach(customer3, lambda status: status != OrderStatus.BACKING)
+    order1.attach(customer4, {OrderStatus.DELIVERED})
     order1.attach(kitchen)
 
     order0.order_status = OrderStatus.PREPARING
@@ -105,7 +295,27 @@ def example():
 
     order1.order_status = OrderStatus.BACKING
     order0.order_status = OrderStatus.BACKING
+    order1.order_status = OrderStatus.DELIVERED
+
+    print(f"Kitchen: {kitchen.summary()}, oldest order: {kitchen.oldest_order().id_}")
+
+
+async def async_example():
+    dispatcher = AsyncDispatcher(max_concurrency=2)
+    customer = Customer("John")
+    kitchen = Kitchen()
+
+    order = PizzaOrder(dispatcher)
+    order.attach(customer)
+    order.attach(kitchen)
+
+    order.order_status = OrderStatus.PREPARING
+    order.order_status = OrderStatus.BACKING
+
+    await dispatcher.drain()
+    print(f"Kitchen: {kitchen.summary()}")
 
 
 if __name__ == '__main__':
     example()
+    asyncio.run(async_example())
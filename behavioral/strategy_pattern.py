@@ -19,12 +19,20 @@ The pattern consists of several key elements, including:
         strategy class should implement the methods defined by the strategy interface.
 """
 
+import time
 from abc import ABC, abstractmethod
 from typing import List
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class PizzaTopping(ABC):
 
+    __slots__ = ()
+
     @abstractmethod
     def get_description(self):
         pass
@@ -36,6 +44,8 @@ class PizzaTopping(ABC):
 
 class PepperoniTopping(PizzaTopping):
 
+    __slots__ = ()
+
     def get_description(self) -> str:
         return "Pepperoni"
 
@@ -45,6 +55,8 @@ class PepperoniTopping(PizzaTopping):
 
 class MushroomTopping(PizzaTopping):
 
+    __slots__ = ()
+
     def get_description(self) -> str:
         return "Mushroom"
 
@@ -54,6 +66,8 @@ class MushroomTopping(PizzaTopping):
 
 class PizzaSize(ABC):
 
+    __slots__ = ()
+
     @abstractmethod
     def get_description(self):
         pass
@@ -65,6 +79,8 @@ class PizzaSize(ABC):
 
 class SmallSize(PizzaSize):
 
+    __slots__ = ()
+
     def get_description(self) -> str:
         return "Small"
 
@@ -74,6 +90,8 @@ class SmallSize(PizzaSize):
 
 class MediumSize(PizzaSize):
 
+    __slots__ = ()
+
     def get_description(self) -> str:
         return "Medium"
 
@@ -81,8 +99,55 @@ class MediumSize(PizzaSize):
         return 12.0
 
 
+class PizzaPartRegistry:
+
+    """
+    Flyweight registry of toppings and sizes. They carry no state, so every order can share one instance per key and
+    compare parts by identity. Costs and descriptions are precomputed into lookup tables at registration.
+    """
+
+    def __init__(self):
+        self._toppings = {}
+        self._sizes = {}
+        self.topping_costs = {}
+        self.topping_descriptions = {}
+        self.size_costs = {}
+        self.size_descriptions = {}
+
+    def register_topping(self, key: str, topping_type: type) -> PizzaTopping:
+        topping = self._toppings[key] = topping_type()
+        self.topping_costs[key] = topping.get_cost()
+        self.topping_descriptions[key] = topping.get_description()
+        return topping
+
+    def register_size(self, key: str, size_type: type) -> PizzaSize:
+        size = self._sizes[key] = size_type()
+        self.size_costs[key] = size.get_cost()
+        self.size_descriptions[key] = size.get_description()
+        return size
+
+    def topping(self, key: str) -> PizzaTopping:
+        return self._toppings[key]
+
+    def size(self, key: str) -> PizzaSize:
+        return self._sizes[key]
+
+    def toppings(self, keys: List[str]) -> List[PizzaTopping]:
+        return [self._toppings[key] for key in keys]
+
+
+parts = PizzaPartRegistry()
+parts.register_topping("pepperoni", PepperoniTopping)
+parts.register_topping("mushroom", MushroomTopping)
+parts.register_size("small", SmallSize)
+parts.register_size("medium", MediumSize)
+
+
 class Pizza:
 
+    # Cost and description are maintained as toppings are added or the size is set, so reading them is O(1).
+    __slots__ = ("_toppings", "_size", "_toppings_cost", "_toppings_string", "_description")
+
     def __init__(self, toppings=None, size=None):
         self.toppings = toppings or []
         self.size = size
@@ -90,34 +155,128 @@ class Pizza:
     def __str__(self) -> str:
         return self.get_description()
 
+    @property
+    def toppings(self) -> tuple:
+        return tuple(self._toppings)
+
+    @toppings.setter
+    def toppings(self, toppings: List[PizzaTopping]) -> None:
+        self._toppings = []
+        self._toppings_cost = 0
+        self._toppings_string = ""
+        self._description = None
+        for topping in toppings:
+            self.add_topping(topping)
+
+    @property
+    def size(self) -> PizzaSize:
+        return self._size
+
+    @size.setter
+    def size(self, size: PizzaSize) -> None:
+        self._size = size
+        self._description = None
+
     def add_topping(self, topping: PizzaTopping) -> None:
-        self.toppings.append(topping)
+        self._toppings.append(topping)
+        self._toppings_cost += topping.get_cost()
+        description = topping.get_description()
+        self._toppings_string = f"{self._toppings_string}, {description}" if len(self._toppings) > 1 else description
+        self._description = None
 
     def set_size(self, size: PizzaSize) -> None:
         self.size = size
 
     def get_description(self) -> str:
-        topping_descriptions = [topping.get_description() for topping in self.toppings]
-        toppings_string = ", ".join(topping_descriptions)
-        size_description = self.size.get_description()
-        return f"{size_description} pizza with {toppings_string}"
+        if self._description is None:
+            self._description = f"{self._size.get_description()} pizza with {self._toppings_string}"
+        return self._description
 
     def get_cost(self) -> float:
-        topping_costs = [topping.get_cost() for topping in self.toppings]
-        return self.size.get_cost() + sum(topping_costs)
+        return self._size.get_cost() + self._toppings_cost
+
+
+class PizzaOrderBatch:
+
+    """
+    Columnar batch of orders sharing one size. Toppings are kept CSR style: the toppings of order i are
+    table[indices[indptr[i]:indptr[i + 1]]]. Costs are computed with numpy over the whole batch, descriptions and
+    Pizza objects are only built when asked for.
+    """
+
+    def __init__(self, size: PizzaSize, indptr, indices, table: List[PizzaTopping]):
+        if np is None:
+            raise ImportError("PizzaOrderBatch requires numpy")
+        self.size = size
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.table = list(table)
+        self._descriptions = None
+
+    @classmethod
+    def from_topping_lists(cls, size: PizzaSize, toppings: List[List[PizzaTopping]]) -> "PizzaOrderBatch":
+        # Shared flyweight toppings map to one table entry, other instances get an entry each.
+        table, positions, indices, indptr = [], {}, [], [0]
+        for order_toppings in toppings:
+            for topping in order_toppings:
+                position = positions.get(id(topping))
+                if position is None:
+                    position = positions[id(topping)] = len(table)
+                    table.append(topping)
+                indices.append(position)
+            indptr.append(len(indices))
+        return cls(size, indptr, indices, table)
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def get_costs(self):
+        table_costs = np.array([topping.get_cost() for topping in self.table], dtype=np.float64)
+        rows = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        toppings_costs = np.bincount(rows, weights=table_costs[self.indices], minlength=len(self))
+        return self.size.get_cost() + toppings_costs
+
+    def get_descriptions(self) -> List[str]:
+        if self._descriptions is None:
+            table_descriptions = [topping.get_description() for topping in self.table]
+            size_description = self.size.get_description()
+            indices = self.indices.tolist()
+            indptr = self.indptr.tolist()
+            self._descriptions = [
+                f"{size_description} pizza with {', '.join(table_descriptions[i] for i in indices[start:end])}"
+                for start, end in zip(indptr, indptr[1:])
+            ]
+        return self._descriptions
+
+    def pizza(self, order: int) -> Pizza:
+        start, end = self.indptr[order], self.indptr[order + 1]
+        return Pizza([self.table[i] for i in self.indices[start:end]], self.size)
+
+    def to_pizzas(self) -> List[Pizza]:
+        return [self.pizza(order) for order in range(len(self))]
 
 
 class PizzaOrderingStrategy(ABC):
 
+    size: PizzaSize
+
     @abstractmethod
     def order_pizza(self, toppings: List[PizzaTopping]):
         pass
 
+    def order_pizzas(self, toppings: List[List[PizzaTopping]]) -> PizzaOrderBatch:
+        return PizzaOrderBatch.from_topping_lists(self.size, toppings)
+
+    def order_pizzas_csr(self, indptr, indices, table: List[PizzaTopping]) -> PizzaOrderBatch:
+        return PizzaOrderBatch(self.size, indptr, indices, table)
+
 
 class BasicPizzaOrderingStrategy(PizzaOrderingStrategy):
 
+    size = parts.size("small")
+
     def order_pizza(self, toppings: List[PizzaTopping]) -> Pizza:
-        pizza = Pizza(size=SmallSize())
+        pizza = Pizza(size=self.size)
         for topping in toppings:
             pizza.add_topping(topping)
         return pizza
@@ -135,9 +294,90 @@ class CustomPizzaOrderingStrategy(PizzaOrderingStrategy):
         return pizza
 
 
+class _Route:
+
+    __slots__ = ("calls", "samples", "mean_ns", "best")
+
+    def __init__(self, strategies_count: int):
+        self.calls = 0
+        self.samples = [0] * strategies_count
+        self.mean_ns = [0.0] * strategies_count
+        self.best = 0
+
+
+class PizzaOrderingContext:
+
+    """
+    Context holding interchangeable strategies for the same orders. Calls are routed per input size bucket (topping or
+    order count rounded to a power of two) to the strategy with the lowest measured latency. Every strategy is timed
+    min_samples times per bucket first, after that only every sample_every-th call is timed, and every explore_every-th
+    call goes to the next strategy in turn so routes follow changes in performance.
+    """
+
+    def __init__(self, strategies: List[PizzaOrderingStrategy], sample_every: int = 16, explore_every: int = 1000,
+                 min_samples: int = 3, smoothing: float = 0.2):
+        self.strategies = list(strategies)
+        self.sample_every = sample_every
+        self.explore_every = explore_every
+        self.min_samples = min_samples
+        self.smoothing = smoothing
+        self._routes = {}
+
+    def order_pizza(self, toppings: List[PizzaTopping] = None) -> Pizza:
+        return self._call("order_pizza", toppings)
+
+    def order_pizzas(self, toppings: List[List[PizzaTopping]]) -> PizzaOrderBatch:
+        return self._call("order_pizzas", toppings)
+
+    def _call(self, method: str, toppings: list):
+        # Strategies accept None for no toppings, it falls in the same bucket as an empty list.
+        key = (method, len(toppings or ()).bit_length())
+        route = self._routes.get(key)
+        if route is None:
+            route = self._routes[key] = _Route(len(self.strategies))
+        route.calls += 1
+        index, timed = self._choose(route)
+        strategy_method = getattr(self.strategies[index], method)
+        if not timed:
+            return strategy_method(toppings)
+        start = time.perf_counter_ns()
+        result = strategy_method(toppings)
+        self._record(route, index, time.perf_counter_ns() - start)
+        return result
+
+    def _choose(self, route: _Route) -> tuple[int, bool]:
+        for index, samples in enumerate(route.samples):
+            if samples < self.min_samples:
+                return index, True
+        if route.calls % self.explore_every == 0:
+            return (route.calls // self.explore_every) % len(self.strategies), True
+        return route.best, route.calls % self.sample_every == 0
+
+    def _record(self, route: _Route, index: int, elapsed_ns: int) -> None:
+        if route.samples[index]:
+            route.mean_ns[index] += self.smoothing * (elapsed_ns - route.mean_ns[index])
+        else:
+            route.mean_ns[index] = elapsed_ns
+        route.samples[index] += 1
+        measured = [index for index, samples in enumerate(route.samples) if samples]
+        route.best = min(measured, key=route.mean_ns.__getitem__)
+
+    def routes(self) -> dict:
+        return {key: self.strategies[route.best] for key, route in self._routes.items()}
+
+    def timings(self) -> dict:
+        return {
+            key: [
+                {"strategy": type(strategy).__name__, "samples": samples, "mean_ns": mean_ns}
+                for strategy, samples, mean_ns in zip(self.strategies, route.samples, route.mean_ns)
+            ]
+            for key, route in self._routes.items()
+        }
+
+
 def example():
-    pepperoni = PepperoniTopping()
-    mushroom = MushroomTopping()
+    pepperoni = parts.topping("pepperoni")
+    mushroom = parts.topping("mushroom")
 
     basic_strategy = BasicPizzaOrderingStrategy()
 
@@ -145,11 +385,21 @@ def example():
     print(pizza.get_description())
     print(pizza.get_cost())
 
-    custom_strategy = CustomPizzaOrderingStrategy(MediumSize())
+    custom_strategy = CustomPizzaOrderingStrategy(parts.size("medium"))
 
     pizza2 = custom_strategy.order_pizza([pepperoni, mushroom])
     print(pizza2)
 
+    context = PizzaOrderingContext([custom_strategy, CustomPizzaOrderingStrategy(parts.size("medium"))])
+    for _ in range(10):
+        context.order_pizza([pepperoni, mushroom])
+    print({f"{method}, bucket {bucket}": type(strategy).__name__ for (method, bucket), strategy in context.routes().items()})
+
+    if np is not None:
+        batch = custom_strategy.order_pizzas([[pepperoni], [pepperoni, mushroom], []])
+        print(batch.get_costs().tolist())
+        print(batch.get_descriptions())
+
 
 if __name__ == '__main__':
     example()
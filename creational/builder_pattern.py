@@ -15,34 +15,115 @@ process, and the ability to modify the construction process without affecting th
 """
 
 
+from collections.abc import Mapping
+
+
 class Pizza:
-    def __init__(self):
-        self.base = None
-        self.toppings = []
-        self.cheeses = []
+
+    # Immutable value: toppings and cheeses are tuples, pizzas hash and compare by content so they work as cache keys.
+    __slots__ = ("base", "toppings", "cheeses", "_hash")
+
+    def __init__(self, base: str = None, toppings: tuple = (), cheeses: tuple = ()):
+        object.__setattr__(self, "base", base)
+        object.__setattr__(self, "toppings", tuple(toppings))
+        object.__setattr__(self, "cheeses", tuple(cheeses))
+        object.__setattr__(self, "_hash", hash((base, self.toppings, self.cheeses)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        # copy, deepcopy and pickle rebuild the pizza through __init__ instead of setting slots one by one.
+        return Pizza, (self.base, self.toppings, self.cheeses)
+
+    def __eq__(self, other):
+        if not isinstance(other, Pizza):
+            return NotImplemented
+        return (self._hash == other._hash and self.base == other.base and self.toppings == other.toppings
+                and self.cheeses == other.cheeses)
+
+    def __hash__(self):
+        return self._hash
 
     def __repr__(self):
         return f"{self.base.capitalize()} pizza with {', '.join(self.toppings)} and {', '.join(self.cheeses)}"
 
 
+def _unroll(chain) -> tuple:
+    items = []
+    while chain is not None:
+        chain, item = chain
+        items.append(item)
+    items.reverse()
+    return tuple(items)
+
+
 class PizzaBuilder:
     def __init__(self):
-        self.pizza = Pizza()
+        self.base = None
+        # Persistent chains of (previous chain, item) pairs, never changed in place. Adding is O(1) and branches built
+        # from a common prefix share its links instead of copying them.
+        self._toppings = None
+        self._cheeses = None
+        # Pizza from the last bake(), returned again until the builder changes.
+        self._baked = None
+
+    @property
+    def toppings(self) -> tuple:
+        return _unroll(self._toppings)
+
+    @property
+    def cheeses(self) -> tuple:
+        return _unroll(self._cheeses)
 
     def set_base(self, base: str):
-        self.pizza.base = base
+        self.base = base
+        self._baked = None
         return self
 
     def add_topping(self, topping: str):
-        self.pizza.toppings.append(topping)
+        self._toppings = (self._toppings, topping)
+        self._baked = None
         return self
 
     def add_cheese(self, cheese: str):
-        self.pizza.cheeses.append(cheese)
+        self._cheeses = (self._cheeses, cheese)
+        self._baked = None
         return self
 
+    def branch(self) -> "PizzaBuilder":
+        builder = PizzaBuilder()
+        builder.base = self.base
+        builder._toppings = self._toppings
+        builder._cheeses = self._cheeses
+        builder._baked = self._baked
+        return builder
+
     def bake(self) -> Pizza:
-        return self.pizza
+        if self._baked is None:
+            self._baked = Pizza(self.base, self.toppings, self.cheeses)
+        return self._baked
+
+    @staticmethod
+    def build_many(records) -> list[Pizza]:
+        """
+        Builds a pizza per (base, toppings, cheeses) record, mappings with those keys work too. Equal topping and
+        cheese lists are stored once and shared by every pizza using them.
+        """
+        shared = {}
+        pizzas = []
+        for record in records:
+            if isinstance(record, Mapping):
+                base, toppings, cheeses = record.get("base"), record.get("toppings", ()), record.get("cheeses", ())
+            else:
+                base, toppings, cheeses = record
+            toppings = tuple(toppings)
+            cheeses = tuple(cheeses)
+            pizzas.append(Pizza(base, shared.setdefault(toppings, toppings), shared.setdefault(cheeses, cheeses)))
+        return pizzas
 
 
 def example():
@@ -53,6 +134,17 @@ def example():
         .bake()
     print(my_pizza)
 
+    template = PizzaBuilder().set_base('thin crust').add_cheese('mozzarella')
+    margherita = template.branch().add_topping('basil').bake()
+    funghi = template.branch().add_topping('mushrooms').bake()
+    print(margherita, funghi)
+
+    catalogue = PizzaBuilder.build_many([
+        ('thin crust', ['mushrooms'], ['mozzarella']),
+        {'base': 'thin crust', 'toppings': ['mushrooms'], 'cheeses': ['mozzarella']},
+    ])
+    print(len(set(catalogue)))
+
 
 if __name__ == '__main__':
     example()
@@ -18,9 +18,24 @@ families of related objects.
 """
 
 
+import collections
+import contextlib
 import enum
+import functools
+import gc
+import importlib
+import importlib.metadata
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import timeit
 from abc import ABC
 
+import pizza_events as events
+
 
 class PizzaType(enum.Enum):
 
@@ -30,6 +45,10 @@ class PizzaType(enum.Enum):
 
 class Pizza(ABC):
 
+    def reset(self) -> None:
+        # Called before a pooled pizza is handed out again, subclasses with state clear it here.
+        pass
+
     def prepare(self) -> None:
         pass
 
@@ -46,42 +65,188 @@ class Pizza(ABC):
 class CheesePizza(Pizza):
 
     def prepare(self) -> None:
-        print("Preparing cheese pizza...")
+        events.emit("pizza.prepare", "Preparing cheese pizza...")
 
     def bake(self) -> None:
-        print("Baking cheese pizza...")
+        events.emit("pizza.bake", "Baking cheese pizza...")
 
     def cut(self) -> None:
-        print("Cutting cheese pizza...")
+        events.emit("pizza.cut", "Cutting cheese pizza...")
 
     def box(self) -> None:
-        print("Boxing cheese pizza...")
+        events.emit("pizza.box", "Boxing cheese pizza...")
 
 
 class PepperoniPizza(Pizza):
 
     def prepare(self) -> None:
-        print("Preparing pepperoni pizza...")
+        events.emit("pizza.prepare", "Preparing pepperoni pizza...")
 
     def bake(self) -> None:
-        print("Baking pepperoni pizza...")
+        events.emit("pizza.bake", "Baking pepperoni pizza...")
 
     def cut(self) -> None:
-        print("Cutting pepperoni pizza...")
+        events.emit("pizza.cut", "Cutting pepperoni pizza...")
 
     def box(self) -> None:
-        print("Boxing pepperoni pizza...")
+        events.emit("pizza.box", "Boxing pepperoni pizza...")
+
+
+class MargheritaPizza(Pizza):
+
+    def prepare(self) -> None:
+        events.emit("pizza.prepare", "Preparing margherita pizza...")
+
+    def bake(self) -> None:
+        events.emit("pizza.bake", "Baking margherita pizza...")
+
+    def cut(self) -> None:
+        events.emit("pizza.cut", "Cutting margherita pizza...")
+
+    def box(self) -> None:
+        events.emit("pizza.box", "Boxing margherita pizza...")
 
 
 class PizzaFactory:
 
-    @staticmethod
-    def create_pizza(pizza_type: PizzaType) -> Pizza:
-        match pizza_type:
-            case PizzaType.CHEESE:
-                return CheesePizza()
-            case PizzaType.PEPPERONI:
-                return PepperoniPizza()
+    ENTRY_POINT_GROUP = "design_patterns.pizzas"
+
+    # Pizza type -> constructor. Types registered by "module:Class" path or entry point wait in _lazy until their
+    # first order, so their modules are only imported when actually needed.
+    _constructors = {
+        PizzaType.CHEESE: CheesePizza,
+        PizzaType.PEPPERONI: PepperoniPizza,
+    }
+    _lazy = {}
+    # Reentrant, a plugin module may order other lazily registered pizzas while it is being imported.
+    _lock = threading.RLock()
+
+    @classmethod
+    def register(cls, pizza_type, constructor) -> None:
+        with cls._lock:
+            if isinstance(constructor, (str, importlib.metadata.EntryPoint)):
+                cls._constructors.pop(pizza_type, None)
+                cls._lazy[pizza_type] = constructor
+            else:
+                cls._lazy.pop(pizza_type, None)
+                cls._constructors[pizza_type] = constructor
+
+    @classmethod
+    def load_entry_points(cls, group: str = ENTRY_POINT_GROUP) -> None:
+        # Entry point names matching a PizzaType member register that member, others register the name itself.
+        for entry_point in importlib.metadata.entry_points(group=group):
+            cls.register(PizzaType.__members__.get(entry_point.name.upper(), entry_point.name), entry_point)
+
+    @classmethod
+    def create_pizza(cls, pizza_type: PizzaType) -> Pizza:
+        return cls.constructor_for(pizza_type)()
+
+    @classmethod
+    def constructor_for(cls, pizza_type: PizzaType):
+        constructor = cls._constructors.get(pizza_type)
+        if constructor is None:
+            constructor = cls._resolve(pizza_type)
+        return constructor
+
+    @classmethod
+    def _resolve(cls, pizza_type):
+        with cls._lock:
+            # Another thread may have resolved it while this one was waiting for the lock.
+            constructor = cls._constructors.get(pizza_type)
+            if constructor is not None:
+                return constructor
+            try:
+                target = cls._lazy[pizza_type]
+            except KeyError:
+                raise ValueError(f"Unknown pizza type: {pizza_type!r}") from None
+            # A failed import leaves the registration in _lazy, the next order tries again.
+            if isinstance(target, importlib.metadata.EntryPoint):
+                constructor = target.load()
+            else:
+                module_name, _, attribute = target.partition(":")
+                constructor = functools.reduce(getattr, attribute.split("."), importlib.import_module(module_name))
+            cls._constructors[pizza_type] = constructor
+            del cls._lazy[pizza_type]
+            return constructor
+
+
+class PizzaPool:
+
+    """
+    Pooled factory mode: released pizzas are reset and kept, up to max_size per constructor, and handed out again by
+    create_pizza() instead of allocating new ones. Pools are keyed by the constructor the factory resolved, a class or
+    any other callable, and a pizza goes back to the pool of the constructor it came from on release(). Safe to share
+    between threads. Only pizzas currently handed out by this pool can be released, releasing one twice or one the
+    pool never handed out raises ValueError.
+    """
+
+    def __init__(self, factory: type = PizzaFactory, max_size: int = 64):
+        self.factory = factory
+        self.max_size = max_size
+        self._pools = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        # id -> (pizza, constructor) handed out and not released yet, holding the pizza keeps its id from being reused.
+        self._checked_out = {}
+        self.acquired = 0
+        self.hits = 0
+        self.released = 0
+        self.discarded = 0
+        self.in_use = 0
+        self.high_water_mark = 0
+
+    def create_pizza(self, pizza_type: PizzaType) -> Pizza:
+        # The factory resolves lazily registered types under its own lock.
+        constructor = self.factory.constructor_for(pizza_type)
+        with self._lock:
+            pool = self._pools.get(constructor)
+            if pool:
+                self.hits += 1
+                return self._check_out(pool.pop(), constructor)
+        pizza = constructor()
+        with self._lock:
+            return self._check_out(pizza, constructor)
+
+    def _check_out(self, pizza: Pizza, constructor) -> Pizza:
+        self._checked_out[id(pizza)] = (pizza, constructor)
+        self.acquired += 1
+        self.in_use += 1
+        self.high_water_mark = max(self.high_water_mark, self.in_use)
+        return pizza
+
+    def release(self, pizza: Pizza) -> None:
+        with self._lock:
+            checked_out, constructor = self._checked_out.get(id(pizza), (None, None))
+            if checked_out is not pizza:
+                raise ValueError(f"{pizza!r} is not checked out from this pool")
+            del self._checked_out[id(pizza)]
+            self.released += 1
+            self.in_use -= 1
+        pizza.reset()
+        with self._lock:
+            pool = self._pools[constructor]
+            if len(pool) < self.max_size:
+                pool.append(pizza)
+            else:
+                self.discarded += 1
+
+    @contextlib.contextmanager
+    def pizza(self, pizza_type: PizzaType):
+        pizza = self.create_pizza(pizza_type)
+        try:
+            yield pizza
+        finally:
+            self.release(pizza)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "acquired": self.acquired,
+                "hit_rate": self.hits / self.acquired if self.acquired else 0.0,
+                "in_use": self.in_use,
+                "high_water_mark": self.high_water_mark,
+                "pooled": sum(len(pool) for pool in self._pools.values()),
+                "discarded": self.discarded,
+            }
 
 
 def example():
@@ -99,7 +264,133 @@ def example():
     pepperoni_pizza.bake()
     pepperoni_pizza.cut()
     pepperoni_pizza.box()
+    print()
+
+    PizzaFactory.register("margherita", f"{__name__}:MargheritaPizza")
+    margherita_pizza = pizza_factory.create_pizza("margherita")
+    margherita_pizza.prepare()
+    margherita_pizza.bake()
+    margherita_pizza.cut()
+    margherita_pizza.box()
+
+
+def benchmark(catalogue_sizes=(2, 10, 100, 1000), number=100_000):
+    plugin_template = (
+        "class Pizza{index}:\n"
+        "    def prepare(self):\n        pass\n"
+    )
+    with tempfile.TemporaryDirectory() as plugin_dir:
+        sys.path.insert(0, plugin_dir)
+        try:
+            for size in catalogue_sizes:
+                modules = [f"bench_pizza_{size}_{index}" for index in range(size)]
+                try:
+                    for index, module in enumerate(modules):
+                        with open(os.path.join(plugin_dir, f"{module}.py"), "w") as file:
+                            file.write(plugin_template.format(index=index))
+                    importlib.invalidate_caches()
+
+                    eager_time = timeit.timeit(lambda: [importlib.import_module(module) for module in modules],
+                                               number=1)
+                    for module in modules:
+                        del sys.modules[module]
+
+                    class BenchmarkFactory(PizzaFactory):
+                        _constructors = {}
+                        _lazy = {}
+                        _lock = threading.RLock()
+
+                    lazy_time = timeit.timeit(
+                        lambda: [BenchmarkFactory.register(index, f"{module}:Pizza{index}")
+                                 for index, module in enumerate(modules)],
+                        number=1,
+                    )
+                    for index in range(size):
+                        BenchmarkFactory.create_pizza(index)
+
+                    # Same dispatch written as an if/elif chain over every type, like a match statement.
+                    classes = [BenchmarkFactory._constructors[index] for index in range(size)]
+                    branches = "".join(
+                        f"    {'if' if index == 0 else 'elif'} pizza_type == {index}:\n"
+                        f"        return classes[{index}]()\n"
+                        for index in range(size)
+                    )
+                    namespace = {"classes": classes}
+                    exec(f"def create_pizza(pizza_type):\n{branches}", namespace)
+                    chained = namespace["create_pizza"]
+
+                    types = [random.randrange(size) for _ in range(1024)]
+                    registry_time = timeit.timeit(lambda: [BenchmarkFactory.create_pizza(t) for t in types],
+                                                  number=number // 1024)
+                    chain_time = timeit.timeit(lambda: [chained(t) for t in types], number=number // 1024)
+                    calls = number // 1024 * 1024
+                    print(
+                        f"{size:>5} types: cold start eager import {eager_time * 1e3:8.2f}ms, lazy registry "
+                        f"{lazy_time * 1e3:6.2f}ms | dispatch registry {registry_time / calls * 1e9:6.0f}ns, "
+                        f"if-chain {chain_time / calls * 1e9:6.0f}ns"
+                    )
+                finally:
+                    # Modules imported through the registry would otherwise outlive their deleted directory.
+                    for module in modules:
+                        sys.modules.pop(module, None)
+        finally:
+            sys.path.remove(plugin_dir)
+
+
+def pool_stress_test(threads: int = 8, orders_per_thread: int = 50_000, in_flight: int = 256):
+    def run(create_pizza, release) -> tuple[int, int, float]:
+        allocations = 0
+        allocations_lock = threading.Lock()
+        original_init = Pizza.__init__
+
+        def counting_init(pizza, *args, **kwargs):
+            nonlocal allocations
+            with allocations_lock:
+                allocations += 1
+            original_init(pizza, *args, **kwargs)
+
+        def work() -> None:
+            # Every thread keeps a window of orders in progress, like a busy kitchen.
+            orders = collections.deque()
+            for index in range(orders_per_thread):
+                pizza = create_pizza(PizzaType.CHEESE if index % 2 else PizzaType.PEPPERONI)
+                pizza.prepare()
+                pizza.bake()
+                orders.append(pizza)
+                if len(orders) > in_flight:
+                    pizza = orders.popleft()
+                    pizza.cut()
+                    pizza.box()
+                    release(pizza)
+            for pizza in orders:
+                release(pizza)
+
+        Pizza.__init__ = counting_init
+        collections_before = sum(stats["collections"] for stats in gc.get_stats())
+        started = time.perf_counter()
+        try:
+            workers = [threading.Thread(target=work) for _ in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            # Pizza inherits __init__, removing the patch restores that instead of pinning object.__init__ on it.
+            del Pizza.__init__
+        elapsed = time.perf_counter() - started
+        return allocations, sum(stats["collections"] for stats in gc.get_stats()) - collections_before, elapsed
+
+    pool = PizzaPool(max_size=threads * in_flight)
+    with events.use_sink(events.NullSink()):
+        unpooled = run(PizzaFactory.create_pizza, lambda pizza: None)
+        pooled = run(pool.create_pizza, pool.release)
+    for name, (allocations, collections_count, elapsed) in (("unpooled", unpooled), ("pooled", pooled)):
+        print(f"{name:>8}: {allocations:>7} pizzas allocated, {collections_count:>4} GC collections, {elapsed:.2f}s")
+    print(f"pool metrics: {pool.metrics()}")
 
 
 if __name__ == "__main__":
     example()
+    if "--benchmark" in sys.argv:
+        benchmark()
+        pool_stress_test()
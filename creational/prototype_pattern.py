@@ -1,6 +1,155 @@
+"""
+The Prototype pattern is a creational design pattern that creates new objects by copying an existing object, the
+prototype, instead of building them from scratch. It is useful when creating an object is expensive or complicated,
+and the new objects only differ slightly from ones that already exist.
+
+The pattern consists of a few key parts:
+
+    *   The Prototype: an object that knows how to clone itself. The clone is a new, independent object with the same
+        state as the original.
+    *   The Prototype Registry: a catalogue of ready made prototypes, looked up by a key. Clients ask the registry for
+        a copy of a prototype instead of constructing the object themselves.
+    *   The Client: it gets a clone from the registry and adjusts whatever makes its object different.
+
+Cloning can be made cheap with copy-on-write: a clone shares the internal data of its prototype and only copies it
+when one of them is modified for the first time. Clones that are never changed, or only changed in some parts, cost
+almost nothing.
+"""
+
+
+import sys
+import timeit
+import tracemalloc
+
+
+class Pizza:
+
+    __slots__ = ("name", "base", "_toppings", "_cheeses", "_toppings_shared", "_cheeses_shared")
+
+    def __init__(self, name: str, base: str, toppings: list[str] = None, cheeses: list[str] = None):
+        self.name = name
+        self.base = base
+        self._toppings = list(toppings or [])
+        self._cheeses = list(cheeses or [])
+        # Set while the list may be used by another pizza too, it gets copied before the first change.
+        self._toppings_shared = False
+        self._cheeses_shared = False
+
+    def __repr__(self):
+        return f"{self.name}: {self.base} pizza with {', '.join(self._toppings)} and {', '.join(self._cheeses)}"
+
+    def clone(self, name: str = None) -> "Pizza":
+        clone = Pizza.__new__(Pizza)
+        clone.name = self.name if name is None else name
+        clone.base = self.base
+        clone._toppings = self._toppings
+        clone._cheeses = self._cheeses
+        self._toppings_shared = self._cheeses_shared = True
+        clone._toppings_shared = clone._cheeses_shared = True
+        return clone
+
+    @property
+    def toppings(self) -> tuple:
+        return tuple(self._toppings)
+
+    @property
+    def cheeses(self) -> tuple:
+        return tuple(self._cheeses)
+
+    def _writable_toppings(self) -> list:
+        if self._toppings_shared:
+            self._toppings = list(self._toppings)
+            self._toppings_shared = False
+        return self._toppings
+
+    def _writable_cheeses(self) -> list:
+        if self._cheeses_shared:
+            self._cheeses = list(self._cheeses)
+            self._cheeses_shared = False
+        return self._cheeses
+
+    def add_topping(self, topping: str) -> "Pizza":
+        self._writable_toppings().append(topping)
+        return self
+
+    def remove_topping(self, topping: str) -> "Pizza":
+        self._writable_toppings().remove(topping)
+        return self
+
+    def add_cheese(self, cheese: str) -> "Pizza":
+        self._writable_cheeses().append(cheese)
+        return self
+
+
+class PizzaPrototypeRegistry:
+
+    def __init__(self):
+        self._prototypes = {}
+
+    def register(self, key: str, pizza: Pizza) -> None:
+        self._prototypes[key] = pizza
+
+    def unregister(self, key: str) -> None:
+        del self._prototypes[key]
+
+    def clone(self, key: str, name: str = None) -> Pizza:
+        try:
+            prototype = self._prototypes[key]
+        except KeyError:
+            raise ValueError(f"Unknown pizza prototype: {key!r}") from None
+        return prototype.clone(name)
+
+
 def example():
-    raise NotImplementedError
+    registry = PizzaPrototypeRegistry()
+    registry.register("margherita", Pizza("Margherita", "thin crust", ["tomato sauce", "basil"], ["mozzarella"]))
+    registry.register("capricciosa", Pizza("Capricciosa", "thick crust", ["tomato sauce", "ham", "mushrooms"],
+                                           ["mozzarella"]))
+
+    extra_cheese = registry.clone("margherita", "Margherita extra cheese").add_cheese("parmesan")
+    spicy = registry.clone("capricciosa", "Spicy capricciosa").add_topping("chili")
+    plain = registry.clone("margherita")
+
+    print(extra_cheese)
+    print(spicy)
+    print(plain)
+
+
+def benchmark(variants: int = 100_000, toppings_count: int = 10):
+    # Only the benchmark compares against the builder, run as a script its module is next to this one.
+    try:
+        from builder_pattern import PizzaBuilder
+    except ImportError:
+        from creational.builder_pattern import PizzaBuilder
+
+    toppings = [f"topping {index}" for index in range(toppings_count)]
+    registry = PizzaPrototypeRegistry()
+    registry.register("base", Pizza("Base", "thin crust", toppings, ["mozzarella"]))
+
+    def fresh():
+        builder = PizzaBuilder().set_base("thin crust")
+        for topping in toppings:
+            builder.add_topping(topping)
+        return builder.add_cheese("mozzarella").add_cheese("parmesan").bake()
+
+    def clone_cheese_tweak():
+        return registry.clone("base").add_cheese("parmesan")
+
+    def clone_topping_tweak():
+        return registry.clone("base").add_topping("chili")
+
+    for name, make in (("builder", fresh), ("clone, cheese tweak", clone_cheese_tweak),
+                       ("clone, topping tweak", clone_topping_tweak)):
+        elapsed = timeit.timeit(make, number=variants)
+        tracemalloc.start()
+        kept = [make() for _ in range(variants)]
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        print(f"{name:>20}: {elapsed / variants * 1e6:6.2f}us per pizza, {memory / variants:6.0f} bytes per pizza")
 
 
 if __name__ == '__main__':
     example()
+    if "--benchmark" in sys.argv:
+        benchmark()
@@ -0,0 +1,209 @@
+"""
+Event sinks shared by the pattern examples. Operations report what they do with emit() instead of calling print()
+directly, the active sink decides what happens with the event. Events carry a template and its fields, the message is
+only formatted by sinks that actually render text, so with NullSink an event costs no string formatting at all.
+
+Available sinks:
+
+    *   PrintSink: formats and prints every event right away, the default.
+    *   NullSink: drops everything.
+    *   RingBufferSink: keeps the last N events in memory.
+    *   BatchedWriterSink: formats and writes events in batches from a background thread.
+    *   StructuredSink: turns events into dict records and passes them to a callback or collects them.
+"""
+
+
+import collections
+import contextlib
+import queue
+import sys
+import threading
+import time
+
+
+class Event:
+
+    __slots__ = ("name", "template", "fields", "timestamp")
+
+    def __init__(self, name: str, template: str, fields: dict):
+        self.name = name
+        self.template = template
+        self.fields = fields
+        self.timestamp = time.time()
+
+    @property
+    def message(self) -> str:
+        return self.template.format(**self.fields)
+
+    def as_record(self) -> dict:
+        fields = {key: list(value.items) if isinstance(value, Joined) else value for key, value in self.fields.items()}
+        return {"event": self.name, "timestamp": self.timestamp, **fields}
+
+
+class Joined:
+
+    """Field value rendered as a comma separated list, joining only happens if the event gets formatted."""
+
+    __slots__ = ("items",)
+
+    def __init__(self, items):
+        self.items = items
+
+    def __format__(self, format_spec: str) -> str:
+        return format(", ".join(str(item) for item in self.items), format_spec)
+
+    def frozen(self) -> "Joined":
+        return Joined(tuple(self.items))
+
+
+def _frozen_fields(fields: dict) -> dict:
+    # Sinks that format later keep a copy of the items, the event shows them as they were when it was emitted.
+    return {key: value.frozen() if isinstance(value, Joined) else value for key, value in fields.items()}
+
+
+class EventSink:
+
+    def emit(self, name: str, template: str, fields: dict) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class NullSink(EventSink):
+
+    def emit(self, name: str, template: str, fields: dict) -> None:
+        pass
+
+
+class PrintSink(EventSink):
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def emit(self, name: str, template: str, fields: dict) -> None:
+        print(template.format(**fields), file=self.stream or sys.stdout)
+
+
+class RingBufferSink(EventSink):
+
+    def __init__(self, capacity: int = 1024):
+        self.events = collections.deque(maxlen=capacity)
+
+    def emit(self, name: str, template: str, fields: dict) -> None:
+        self.events.append(Event(name, template, _frozen_fields(fields)))
+
+    def messages(self) -> list[str]:
+        return [event.message for event in list(self.events)]
+
+
+class BatchedWriterSink(EventSink):
+
+    _STOP = object()
+
+    def __init__(self, stream=None, batch_size: int = 256):
+        self.stream = stream or sys.stdout
+        self.batch_size = batch_size
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="BatchedWriterSink", daemon=True)
+        self._thread.start()
+
+    def emit(self, name: str, template: str, fields: dict) -> None:
+        self._queue.put((template, _frozen_fields(fields)))
+
+    def flush(self) -> None:
+        if not self._thread.is_alive():
+            return
+        # Marker goes through the queue, once it is reached everything emitted before it was written.
+        flushed = threading.Event()
+        self._queue.put(flushed)
+        flushed.wait()
+
+    def close(self) -> None:
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self) -> None:
+        running = True
+        while running:
+            batch, markers = [], []
+            item = self._queue.get()
+            while True:
+                if item is self._STOP:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+                if not running or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                # Whatever happened to the batch, flush() callers waiting on these markers must wake up.
+                for marker in markers:
+                    marker.set()
+
+    def _write(self, batch: list) -> None:
+        # A bad event or a failing stream is reported and skipped, it must not stop the writer thread.
+        lines = []
+        for template, fields in batch:
+            try:
+                lines.append(f"{template.format(**fields)}\n")
+            except Exception as exc:
+                print(f"BatchedWriterSink: can't format {template!r}: {exc!r}", file=sys.stderr)
+        if not lines:
+            return
+        try:
+            self.stream.write("".join(lines))
+            self.stream.flush()
+        except Exception as exc:
+            print(f"BatchedWriterSink: writing {len(lines)} events failed: {exc!r}", file=sys.stderr)
+
+
+class StructuredSink(EventSink):
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.records = []
+
+    def emit(self, name: str, template: str, fields: dict) -> None:
+        record = Event(name, template, fields).as_record()
+        if self.callback is not None:
+            self.callback(record)
+        else:
+            self.records.append(record)
+
+
+_sink = PrintSink()
+
+
+def get_sink() -> EventSink:
+    return _sink
+
+
+def set_sink(sink: EventSink) -> EventSink:
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+@contextlib.contextmanager
+def use_sink(sink: EventSink):
+    previous = set_sink(sink)
+    try:
+        yield sink
+    finally:
+        sink.flush()
+        set_sink(previous)
+
+
+def emit(name: str, template: str, /, **fields) -> None:
+    _sink.emit(name, template, fields)
@@ -26,6 +26,18 @@ Overall, the Facade pattern is a useful tool for simplifying complicated systems
 """
 
 
+import asyncio
+import collections
+import inspect
+import itertools
+import random
+import threading
+import time
+from typing import AsyncIterable, Iterable, Iterator, Union
+
+import pizza_events as events
+
+
 class Pizza:
     def __init__(self, size: int, toppings: list[str]):
         self.size = size
@@ -38,10 +50,11 @@ class Pizza:
 
 
 class PizzaFacade:
-    def __init__(self):
+    def __init__(self, oven_scheduler: "OvenScheduler" = None):
         self.oven = Oven()
         self.cutter = Cutter()
         self.box = Box()
+        self.oven_scheduler = oven_scheduler
 
     def order_pizza(self, size: int, toppings: list[str]) -> Pizza:
         pizza = Pizza(size, toppings)
@@ -51,26 +64,371 @@ class PizzaFacade:
         pizza.is_ready = True
         return pizza
 
+    def order_pizzas(self, specs: Iterable[tuple[int, list[str]]], batch_size: int = 64,
+                     cancel: threading.Event = None) -> Iterator[Pizza]:
+        """
+        Streams (size, toppings) specs into finished pizzas. Only one batch of batch_size pizzas is alive at a time
+        and every subsystem gets the whole batch in one call. Once cancel is set no new batch is started, closing the
+        generator stops it right away.
+        """
+        specs = iter(specs)
+        while cancel is None or not cancel.is_set():
+            batch = [Pizza(size, toppings) for size, toppings in itertools.islice(specs, batch_size)]
+            if not batch:
+                return
+            yield from self._prepare_batch(batch)
+
+    async def order_pizzas_async(self, specs: Union[AsyncIterable, Iterable], batch_size: int = 64,
+                                 cancel: threading.Event = None):
+        if not hasattr(specs, "__aiter__"):
+            for pizza in self.order_pizzas(specs, batch_size, cancel):
+                yield pizza
+            return
+        batch = []
+        async for size, toppings in specs:
+            if cancel is not None and cancel.is_set():
+                return
+            batch.append(Pizza(size, toppings))
+            if len(batch) >= batch_size:
+                for pizza in self._prepare_batch(batch):
+                    yield pizza
+                batch = []
+        if batch:
+            for pizza in self._prepare_batch(batch):
+                yield pizza
+
+    def _prepare_batch(self, batch: list[Pizza]) -> list[Pizza]:
+        if self.oven_scheduler is None:
+            self.oven.bake_many(batch)
+        else:
+            # Every pizza of the batch is baked before it returns, so the scheduler only packs the batch into loads.
+            for load in self.oven_scheduler.plan(batch):
+                self.oven.bake_many(load)
+        self.cutter.cut_many(batch)
+        self.box.package_many(batch)
+        for pizza in batch:
+            pizza.is_ready = True
+        return batch
+
 
 class Oven:
 
     @staticmethod
     def bake(pizza: Pizza) -> None:
-        print(f"Baking {pizza.size}cm pizza with {', '.join(pizza.toppings)} toppings...")
+        events.emit("oven.bake", "Baking {size}cm pizza with {toppings} toppings...", size=pizza.size,
+                    toppings=events.Joined(pizza.toppings))
+
+    @staticmethod
+    def bake_many(pizzas: list[Pizza]) -> None:
+        events.emit("oven.bake_many", "Baking {count} pizzas...", count=len(pizzas))
 
 
 class Cutter:
 
     @staticmethod
     def cut(pizza: Pizza) -> None:
-        print(f"Cutting {pizza.size}cm pizza with {', '.join(pizza.toppings)} toppings...")
+        events.emit("cutter.cut", "Cutting {size}cm pizza with {toppings} toppings...", size=pizza.size,
+                    toppings=events.Joined(pizza.toppings))
+
+    @staticmethod
+    def cut_many(pizzas: list[Pizza]) -> None:
+        events.emit("cutter.cut_many", "Cutting {count} pizzas...", count=len(pizzas))
 
 
 class Box:
 
     @staticmethod
     def package(pizza: Pizza) -> None:
-        print(f"Packaging {pizza.size}cm pizza with {', '.join(pizza.toppings)} toppings...")
+        events.emit("box.package", "Packaging {size}cm pizza with {toppings} toppings...", size=pizza.size,
+                    toppings=events.Joined(pizza.toppings))
+
+    @staticmethod
+    def package_many(pizzas: list[Pizza]) -> None:
+        events.emit("box.package_many", "Packaging {count} pizzas...", count=len(pizzas))
+
+
+class OvenScheduler:
+
+    """
+    Collects pending pizzas into oven loads. A load holds at most capacity_cm of pizza diameters in total and is built
+    from one size group, topped up with pizzas whose size is within size_tolerance_cm. A load is released as soon as
+    a size group can fill the oven, or once the oldest pending pizza has waited max_wait, which keeps latency bounded
+    when orders are slow. Times are passed in as now, defaulting to the clock, so simulations can drive it.
+    """
+
+    def __init__(self, capacity_cm: int = 60, max_wait: float = 120.0, size_tolerance_cm: int = 4, clock=time.monotonic):
+        self.capacity_cm = capacity_cm
+        self.max_wait = max_wait
+        self.size_tolerance_cm = size_tolerance_cm
+        self.clock = clock
+        # Size -> FIFO of (pizza, arrival time), plus the total cm waiting in each group.
+        self._groups = {}
+        self._group_cm = collections.Counter()
+        self.loads = 0
+        self.baked = 0
+        self.baked_cm = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+
+    def __len__(self) -> int:
+        return sum(len(group) for group in self._groups.values())
+
+    def add(self, pizza: Pizza, now: float = None) -> None:
+        now = self.clock() if now is None else now
+        self._groups.setdefault(pizza.size, collections.deque()).append((pizza, now))
+        self._group_cm[pizza.size] += pizza.size
+
+    def next_load(self, now: float = None) -> Union[list[Pizza], None]:
+        now = self.clock() if now is None else now
+        heads = [(group[0][1], size) for size, group in self._groups.items() if group]
+        if not heads:
+            return None
+        full = [(arrived, size) for arrived, size in heads if self._group_cm[size] >= self.capacity_cm]
+        if full:
+            return self._take(min(full)[1], now)
+        oldest_arrival, oldest_size = min(heads)
+        if now - oldest_arrival >= self.max_wait:
+            return self._take(oldest_size, now)
+        return None
+
+    def plan(self, pizzas: Iterable[Pizza]) -> list[list[Pizza]]:
+        """
+        Packs pizzas that all have to be baked now into loads with the same rules, without waiting for a full oven and
+        without touching the pizzas pending in this scheduler. Loads planned this way count in metrics().
+        """
+        planner = OvenScheduler(self.capacity_cm, self.max_wait, self.size_tolerance_cm, self.clock)
+        now = self.clock()
+        for pizza in pizzas:
+            planner.add(pizza, now)
+        loads = list(planner.drain(now))
+        self.loads += planner.loads
+        self.baked += planner.baked
+        self.baked_cm += planner.baked_cm
+        return loads
+
+    def drain(self, now: float = None) -> Iterator[list[Pizza]]:
+        now = self.clock() if now is None else now
+        while True:
+            heads = [(group[0][1], size) for size, group in self._groups.items() if group]
+            if not heads:
+                return
+            yield self._take(min(heads)[1], now)
+
+    def _take(self, size: int, now: float) -> list[Pizza]:
+        similar = sorted(
+            (abs(other - size), other) for other, group in self._groups.items()
+            if group and abs(other - size) <= self.size_tolerance_cm
+        )
+        load, load_cm = [], 0
+        for _, other in similar:
+            group = self._groups[other]
+            # A single pizza larger than the oven is still baked alone.
+            while group and (load_cm + other <= self.capacity_cm or not load):
+                pizza, arrived = group.popleft()
+                self._group_cm[other] -= other
+                load.append(pizza)
+                load_cm += other
+                delay = now - arrived
+                self.total_delay += delay
+                self.max_delay = max(self.max_delay, delay)
+        self.loads += 1
+        self.baked += len(load)
+        self.baked_cm += load_cm
+        return load
+
+    def metrics(self) -> dict:
+        return {
+            "loads": self.loads,
+            "pizzas": self.baked,
+            "pending": len(self),
+            "utilization": self.baked_cm / (self.loads * self.capacity_cm) if self.loads else 0.0,
+            "mean_delay": self.total_delay / self.baked if self.baked else 0.0,
+            "max_delay": self.max_delay,
+        }
+
+
+def simulate_oven(scheduler: OvenScheduler = None, orders_per_hour: float = 30, hours: float = 8,
+                  bake_minutes: float = 8, sizes: tuple = (24, 28, 32, 40), step_minutes: float = 0.1,
+                  seed: int = 0) -> dict:
+    """
+    Single oven simulation with random order arrivals, time in minutes. A load takes bake_minutes no matter how many
+    pizzas are in it. Without a scheduler every pizza is baked on its own, in arrival order.
+    """
+    rng = random.Random(seed)
+    arrivals, now = [], 0.0
+    horizon = hours * 60
+    while True:
+        now += rng.expovariate(orders_per_hour / 60)
+        if now >= horizon:
+            break
+        arrivals.append((now, Pizza(rng.choice(sizes), [])))
+    waiting = collections.deque()
+    arrived, completed, oven_free_at, now = 0, 0, 0.0, 0.0
+    while now < horizon:
+        while arrived < len(arrivals) and arrivals[arrived][0] <= now:
+            if scheduler is None:
+                waiting.append(arrivals[arrived][1])
+            else:
+                scheduler.add(arrivals[arrived][1], now)
+            arrived += 1
+        if oven_free_at <= now:
+            if scheduler is None:
+                load = [waiting.popleft()] if waiting else None
+            else:
+                load = scheduler.next_load(now)
+            if load:
+                oven_free_at = now + bake_minutes
+                if oven_free_at <= horizon:
+                    completed += len(load)
+        now += step_minutes
+    return {"orders": len(arrivals), "completed": completed, "orders_per_hour": completed / hours}
+
+
+class StageMetrics:
+
+    __slots__ = ("processed", "failed", "busy_ns", "wait_ns", "max_depth")
+
+    def __init__(self):
+        self.processed = 0
+        self.failed = 0
+        self.busy_ns = 0
+        self.wait_ns = 0
+        self.max_depth = 0
+
+    @property
+    def mean_latency_ms(self) -> float:
+        return self.busy_ns / self.processed / 1e6 if self.processed else 0.0
+
+    @property
+    def mean_wait_ms(self) -> float:
+        return self.wait_ns / self.processed / 1e6 if self.processed else 0.0
+
+
+class PipelineStage:
+
+    def __init__(self, name: str, operation, workers: int = 1, queue_size: int = 8, blocking: bool = False):
+        self.name = name
+        self.operation = operation
+        self.workers = workers
+        self.queue_size = queue_size
+        # Blocking operations run in a worker thread, so they don't stall the event loop.
+        self.blocking = blocking and not inspect.iscoroutinefunction(operation)
+        self.metrics = StageMetrics()
+        self.queue = None
+
+    async def run(self, pizza: Pizza) -> None:
+        if self.blocking:
+            await asyncio.to_thread(self.operation, pizza)
+            return
+        result = self.operation(pizza)
+        if inspect.isawaitable(result):
+            await result
+
+
+class PipelinedPizzaFacade:
+
+    """
+    Asynchronous PizzaFacade running baking, cutting and packaging as separate pipeline stages. Stages are connected by
+    bounded queues, a full queue makes the stage before it (and eventually order_pizza) wait, and every stage runs its
+    own number of workers. With N pizzas in different stages at once throughput is bound by the slowest stage instead
+    of the sum of all of them. Subsystem methods may be plain functions, coroutines or, with blocking=True, blocking
+    calls moved to threads.
+    """
+
+    def __init__(self, oven=None, cutter=None, box=None, workers: Union[int, tuple[int, int, int]] = 1,
+                 queue_size: int = 8, blocking: bool = False):
+        self.oven = oven or Oven()
+        self.cutter = cutter or Cutter()
+        self.box = box or Box()
+        operations = (("bake", self.oven.bake), ("cut", self.cutter.cut), ("package", self.box.package))
+        # One worker count for every stage, or one per stage in bake, cut, package order.
+        if isinstance(workers, int):
+            workers = (workers,) * len(operations)
+        workers = tuple(workers)
+        if len(workers) != len(operations):
+            raise ValueError(f"Expected {len(operations)} worker counts, one per stage, got {len(workers)}")
+        if any(stage_workers < 1 for stage_workers in workers):
+            raise ValueError(f"Every stage needs at least one worker, got {workers}")
+        self.stages = [
+            PipelineStage(name, operation, stage_workers, queue_size, blocking)
+            for (name, operation), stage_workers in zip(operations, workers)
+        ]
+        self._tasks = []
+
+    async def __aenter__(self) -> "PipelinedPizzaFacade":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def start(self) -> None:
+        for stage in self.stages:
+            stage.queue = asyncio.Queue(maxsize=stage.queue_size)
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            self._tasks.extend(
+                asyncio.create_task(self._work(stage, next_stage), name=f"{stage.name}-{worker}")
+                for worker in range(stage.workers)
+            )
+
+    async def stop(self) -> None:
+        for stage in self.stages:
+            await stage.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def submit(self, size: int, toppings: list[str]) -> asyncio.Future:
+        pizza = Pizza(size, toppings)
+        done = asyncio.get_running_loop().create_future()
+        await self._put(self.stages[0], (pizza, done))
+        return done
+
+    async def order_pizza(self, size: int, toppings: list[str]) -> Pizza:
+        return await (await self.submit(size, toppings))
+
+    async def _put(self, stage: PipelineStage, item: tuple) -> None:
+        await stage.queue.put((item, time.perf_counter_ns()))
+        stage.metrics.max_depth = max(stage.metrics.max_depth, stage.queue.qsize())
+
+    async def _work(self, stage: PipelineStage, next_stage: PipelineStage) -> None:
+        metrics = stage.metrics
+        while True:
+            (pizza, done), queued_at = await stage.queue.get()
+            started_at = time.perf_counter_ns()
+            metrics.wait_ns += started_at - queued_at
+            try:
+                await stage.run(pizza)
+            except Exception as exc:
+                metrics.failed += 1
+                if not done.done():
+                    done.set_exception(exc)
+            else:
+                metrics.processed += 1
+                metrics.busy_ns += time.perf_counter_ns() - started_at
+                if next_stage is not None:
+                    await self._put(next_stage, (pizza, done))
+                else:
+                    pizza.is_ready = True
+                    if not done.done():
+                        done.set_result(pizza)
+            finally:
+                stage.queue.task_done()
+
+    def metrics(self) -> dict:
+        return {
+            stage.name: {
+                "queue_depth": stage.queue.qsize() if stage.queue is not None else 0,
+                "max_queue_depth": stage.metrics.max_depth,
+                "processed": stage.metrics.processed,
+                "failed": stage.metrics.failed,
+                "mean_latency_ms": stage.metrics.mean_latency_ms,
+                "mean_wait_ms": stage.metrics.mean_wait_ms,
+            }
+            for stage in self.stages
+        }
 
 
 def example():
@@ -78,6 +436,27 @@ def example():
     pizza = pizza_facade.order_pizza(12, ['cheese', 'pepperoni', 'mushrooms'])
     print(pizza)
 
+    catering_order = ((size, ['cheese']) for size in itertools.islice(itertools.cycle([12, 16, 20]), 5))
+    for pizza in pizza_facade.order_pizzas(catering_order, batch_size=2):
+        print(pizza)
+
+    per_pizza = simulate_oven()
+    scheduler = OvenScheduler(capacity_cm=100, max_wait=10)
+    batched = simulate_oven(scheduler)
+    print(f"Simulated orders per hour: per pizza {per_pizza['orders_per_hour']:.1f}, "
+          f"batched {batched['orders_per_hour']:.1f}, utilization {scheduler.metrics()['utilization']:.0%}")
+
+
+async def async_example():
+    async with PipelinedPizzaFacade(workers=(2, 1, 1)) as pizza_facade:
+        pizzas = await asyncio.gather(
+            pizza_facade.order_pizza(12, ['cheese', 'pepperoni']),
+            pizza_facade.order_pizza(16, ['cheese', 'mushrooms']),
+        )
+    for pizza in pizzas:
+        print(pizza)
+
 
 if __name__ == '__main__':
     example()
+    asyncio.run(async_example())